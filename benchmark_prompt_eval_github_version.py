@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import statistics
+
+import ollama
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from prompt_template_github_version import *
+from benchmark_truncation_github_version import make_page
+from check_parser_backends_github_version import folder_pages
+
+# -------------------------
+# Prompt-eval cost per template
+# -------------------------
+# Every template runs over the same pages, one request at a time so that all
+# requests land in the same server slot, with num_predict=1 so the request is
+# almost all prompt evaluation. Ollama reports in prompt_eval_count and
+# prompt_eval_duration only the tokens it had to evaluate, so a prefix reused
+# from the KV cache shows up as fewer tokens and less time. The first request
+# of each template starts from a cache holding the other template and is
+# reported apart. The server is taken from OLLAMA_HOST; pointing it at a
+# stand-in server works the same way.
+
+def run_template(client, model, pages, version, api="generate"):
+    records = []
+    for name, html in pages.items():
+        prompt = build_prompt(html, len(html), version=version, api=api)
+        options = {"num_predict": 1, "temperature": 0.0, "seed": 2107}
+        t1 = time.time()
+        if api == "chat":
+            result = client.chat(model=model, messages=prompt, keep_alive=-1, options=options)
+        else:
+            result = client.generate(model=model, prompt=prompt, keep_alive=-1, options=options)
+        t2 = time.time()
+        records.append({
+            "page": name,
+            "prompt_chars": len(prompt) if api == "generate" else sum(len(m["content"]) for m in prompt),
+            "prompt_eval_count": result.get("prompt_eval_count") or 0,
+            "prompt_eval_duration": (result.get("prompt_eval_duration") or 0) / 1e9,
+            "wall_time": t2 - t1,
+        })
+    return records
+
+def summarize(records) -> dict:
+    warm = records[1:] or records
+    return {
+        "first_prompt_eval_count": records[0]["prompt_eval_count"],
+        "first_prompt_eval_duration": records[0]["prompt_eval_duration"],
+        "mean_prompt_eval_count": statistics.mean(r["prompt_eval_count"] for r in warm),
+        "mean_prompt_eval_duration": statistics.mean(r["prompt_eval_duration"] for r in warm),
+        "mean_wall_time": statistics.mean(r["wall_time"] for r in warm),
+    }
+
+def bench_prompt_eval(model, pages, versions=("v4", "v5"), api="generate", host=None) -> dict:
+    client = ollama.Client(host=host)
+    # Load the model before the first timed request
+    client.generate(model=model, keep_alive=-1)
+    report = {version: summarize(run_template(client, model, pages, version, api)) for version in versions}
+    client.generate(model=model, keep_alive=0)
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: benchmark_prompt_eval_github_version.py MODEL [DATASET_FOLDER] [generate|chat]
+    model = sys.argv[1] if len(sys.argv) > 1 else "gemma3:1b"
+    if len(sys.argv) > 2 and sys.argv[2] != "-":
+        pages = folder_pages(sys.argv[2], limit=20)
+    else:
+        pages = {f"synthetic_{n}": make_page(n) for n in range(40, 240, 10)}
+    api = sys.argv[3] if len(sys.argv) > 3 else "generate"
+    report = bench_prompt_eval(model, pages, api=api)
+    for version, summary in report.items():
+        print(version, {k: round(v, 4) for k, v in summary.items()})
+    base, other = report["v4"], report["v5"]
+    print(f"prompt tokens evaluated saved per request: "
+          f"{base['mean_prompt_eval_count'] - other['mean_prompt_eval_count']:.1f}")
+    print(f"prompt eval seconds saved per request: "
+          f"{base['mean_prompt_eval_duration'] - other['mean_prompt_eval_duration']:.4f}")
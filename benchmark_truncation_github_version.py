@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import *
+from check_parser_backends_github_version import folder_pages
+
+
+# -------------------------
+# Synthetic pages
+# -------------------------
+def make_page(n_tags: int) -> str:
+    rows = []
+    for i in range(n_tags):
+        if i % 4 == 0:
+            rows.append(f'<a href="https://example.com/login/{i}">Sign in {i}</a>')
+        elif i % 4 == 1:
+            rows.append(f"<p>Paragraph {i} with some text about your account.</p>")
+        elif i % 4 == 2:
+            rows.append(f'<img src="/img/logo_{i}.png" alt="logo {i}">')
+        else:
+            rows.append(f"<li>Item {i}</li>")
+    return "<html><head><title>Bench</title></head><body>" + "".join(rows) + "</body></html>"
+
+# -------------------------
+# extract_scored_elements scaling
+# -------------------------
+def bench_extract_scored_elements(sizes=(250, 500, 1000, 2000, 4000), budget_share=0.5):
+    encoding = get_encoding("gpt-4")
+    for n in sizes:
+        soup = pre_clean_html(make_page(n))
+        max_tokens = int(len(encoding.encode(str(soup))) * budget_share)
+        t1 = time.time()
+        extract_scored_elements(soup, max_tokens)
+        t2 = time.time()
+        print(f"tags={n:6d} max_tokens={max_tokens:7d} seconds={t2 - t1:.3f} per_tag_ms={(t2 - t1) / n * 1000:.3f}")
+
+# -------------------------
+# hybrid_trim vs heap_trim
+# -------------------------
+def bench_trim(sizes=(200, 1000, 2000), budget_share=0.5):
+    encoding = get_encoding("gpt-4")
+    for n in sizes:
+        cleaned = str(pre_clean_html(make_page(n)))
+        max_tokens = int(len(encoding.encode(cleaned)) * budget_share)
+        for trim in (hybrid_trim, heap_trim):
+            soup = BeautifulSoup(cleaned, "html.parser")
+            t1 = time.time()
+            trim(soup, max_tokens)
+            t2 = time.time()
+            print(f"tags={n:6d} {trim.__name__:12s} seconds={t2 - t1:.3f}")
+
+
+# -------------------------
+# Benchmark suite
+# -------------------------
+# Times (best of ``repeat``) and peak traced memory (one extra run under
+# tracemalloc, which is slower, so it is not timed) of the truncation stages
+# on deterministic synthetic pages or a local corpus, at several budgets
+# given as shares of the cleaned page's token count. The report is JSON;
+# compare_reports flags every measurement that got slower than a baseline
+# report by more than the threshold.
+
+KB = 1024
+MB = 1024 * KB
+SUITE_SIZES = (10 * KB, 100 * KB, 1 * MB, 10 * MB)
+SUITE_BUDGETS = (0.05, 0.25, 0.5)
+
+# name -> generator settings, on top of the defaults of synthetic_page
+SUITE_SHAPES = {
+    "default": {},
+    "deep": {"depth": 24},
+    "script_heavy": {"script_ratio": 0.6},
+    "link_dense": {"link_density": 0.8},
+}
+
+# Largest page each stage is run on; hybrid_trim scales much worse than the
+# rest (about 20 s per run at 100 KB) and would dominate the suite
+STAGE_MAX_BYTES = {"hybrid_trim": 100 * KB}
+
+# What each pre_clean_html_<backend> stage parses; selectolax and stream only
+# shrink the page before the same html.parser pass as the default backend
+BACKEND_PASSES = {
+    "lxml": "lxml",
+    "selectolax": "lexbor, then html.parser on the stripped page",
+    "stream": "streaming pre-clean, then html.parser on the cleaned page",
+}
+
+_WORDS = ("account", "verify", "login", "password", "secure", "update", "bank", "paypal", "support", "contact",
+          "privacy", "policy", "welcome", "offer", "the", "your", "and", "to", "of", "please")
+
+def synthetic_page(size, depth=6, script_ratio=0.1, link_density=0.3, seed=0) -> str:
+    """
+    Deterministic page of about ``size`` bytes: nested <div>/<section>
+    blocks up to ``depth`` levels holding paragraphs, list items, images,
+    forms and links (``link_density``: share of content elements that are
+    links), with ``script_ratio`` of the bytes in <script>/<style> blocks.
+    The same arguments always give the same page.
+    """
+    rng = random.Random(seed)
+    words = lambda n: " ".join(rng.choice(_WORDS) for _ in range(n))
+    head = ("<html><head><title>Sign in to your account</title>"
+            "<meta name='description' content='Secure login'></head><body>")
+    parts, total, i = [head], len(head), 0
+    script_bytes = 0
+    while total < size:
+        i += 1
+        if script_ratio and script_bytes < script_ratio * total:
+            block = (f"<script>var cfg{i} = {{id: {i}, token: '{rng.getrandbits(64):x}'}};"
+                     f" function f{i}(a) {{ return a * {i}; }}</script>"
+                     if i % 2 else f"<style>.c{i} {{ color: #{rng.getrandbits(24):06x}; margin: {i % 9}px; }}</style>")
+            script_bytes += len(block)
+        else:
+            level = rng.randint(1, depth)
+            inner = []
+            for j in range(rng.randint(2, 6)):
+                r = rng.random()
+                if r < link_density:
+                    path = words(2).replace(" ", "/")
+                    inner.append(f'<a href="https://{rng.choice(_WORDS)}-{i}.example.com/{path}?id={i}{j}">'
+                                 f"{words(3)}</a>")
+                elif r < link_density + (1 - link_density) * 0.5:
+                    inner.append(f"<p>{words(rng.randint(5, 25))}</p>")
+                elif r < link_density + (1 - link_density) * 0.7:
+                    inner.append(f"<li>{words(4)}</li>")
+                elif r < link_density + (1 - link_density) * 0.85:
+                    inner.append(f'<img src="/img/{rng.choice(_WORDS)}_{i}.png" alt="{words(2)}">')
+                else:
+                    inner.append(f'<form action="/{rng.choice(_WORDS)}"><input name="user">'
+                                 f'<input type="password" name="pw"><button>{words(1)}</button></form>')
+            block = ("<div class='c%d'>" % i) * level + "".join(inner) + "</div>" * level
+            if i % 7 == 0:
+                block = f"<section><span></span>{block}<!-- block {i} --></section>"
+        parts.append(block)
+        total += len(block)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def suite_pages(sizes=SUITE_SIZES, shapes=None) -> dict:
+    """{case name: html} of every synthetic shape at every size."""
+    shapes = shapes or SUITE_SHAPES
+    return {f"{shape}_{size // KB}kb": synthetic_page(size, **settings)
+            for shape, settings in shapes.items() for size in sizes}
+
+def _measure(fn, prepare, repeat, memory):
+    best = None
+    for _ in range(repeat):
+        args = prepare()
+        t1 = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - t1
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        args = prepare()
+        tracemalloc.start()
+        fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+def bench_page(name, html, budgets=SUITE_BUDGETS, repeat=3, memory=True, model="gpt-4") -> list:
+    """Measurements of every stage on one page. Parsing for the stages that
+    take a soup happens outside the timed call."""
+    encoding = get_encoding(model)
+    cleaned = str(pre_clean_html(html))
+    cleaned_tokens = len(encoding.encode(cleaned))
+    size = len(html.encode("utf-8"))
+    rows = []
+
+    def record(stage, budget, max_tokens, fn, prepare):
+        if size > STAGE_MAX_BYTES.get(stage, size):
+            return
+        seconds, peak = _measure(fn, prepare, repeat, memory)
+        rows.append({"case": name, "bytes": size, "cleaned_tokens": cleaned_tokens, "stage": stage,
+                     "budget": budget, "max_tokens": max_tokens, "seconds": seconds, "peak_bytes": peak})
+        print(f"{name:24s} {stage:32s} budget={budget!s:5s} seconds={seconds:.4f}"
+              + (f" peak_mb={peak / MB:.1f}" if peak is not None else ""))
+
+    record("pre_clean_html", None, None, pre_clean_html, lambda: (html,))
+    for backend in available_parser_backends():
+        if backend != "html.parser":
+            record(f"pre_clean_html_{backend}", None, None, lambda html, backend=backend: pre_clean_html(html, backend),
+                   lambda: (html,))
+    for budget in budgets:
+        max_tokens = max(int(cleaned_tokens * budget), 1)
+        record("extract_scored_elements", budget, max_tokens, extract_scored_elements,
+               lambda: (BeautifulSoup(cleaned, "html.parser"), max_tokens))
+        record("hybrid_trim", budget, max_tokens, hybrid_trim,
+               lambda: (BeautifulSoup(cleaned, "html.parser"), max_tokens))
+        record("heap_trim", budget, max_tokens, heap_trim, lambda: (BeautifulSoup(cleaned, "html.parser"), max_tokens))
+        record("truncate_html_to_tokens_merged", budget, max_tokens, truncate_html_to_tokens_merged,
+               lambda: (html, max_tokens))
+    return rows
+
+def run_suite(pages, budgets=SUITE_BUDGETS, repeat=3, memory=True) -> dict:
+    results = []
+    for name, html in pages.items():
+        results.extend(bench_page(name, html, budgets, repeat, memory))
+    return {
+        "meta": {
+            "pipeline_version": PIPELINE_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "repeat": repeat,
+            "backend_passes": {b: BACKEND_PASSES[b] for b in available_parser_backends() if b in BACKEND_PASSES},
+        },
+        "results": results,
+    }
+
+def compare_reports(report, baseline, threshold=0.2) -> list:
+    """Measurements of ``report`` more than ``threshold`` (share) slower
+    than the same (case, stage, budget) in ``baseline``."""
+    key = lambda r: (r["case"], r["stage"], r["budget"])
+    before = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        old = before.get(key(r))
+        if old and old["seconds"] > 0 and r["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append({"case": r["case"], "stage": r["stage"], "budget": r["budget"],
+                                "baseline_seconds": old["seconds"], "seconds": r["seconds"],
+                                "slowdown": r["seconds"] / old["seconds"]})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HTML truncation pipeline")
+    parser.add_argument("--report", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against; exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("--corpus", help="dataset folder (one sub-folder per page) instead of synthetic pages")
+    parser.add_argument("--limit", type=int, default=20, help="pages taken from the corpus")
+    parser.add_argument("--max-size", type=int, default=10 * MB, help="largest synthetic page in bytes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--legacy", action="store_true", help="run the earlier scaling benchmarks instead")
+    args = parser.parse_args()
+
+    if args.legacy:
+        bench_extract_scored_elements()
+        bench_trim()
+        sys.exit(0)
+
+    if args.corpus:
+        pages = folder_pages(args.corpus, limit=args.limit)
+    else:
+        pages = suite_pages(sizes=[s for s in SUITE_SIZES if s <= args.max_size])
+    for backend in available_parser_backends():
+        if backend in BACKEND_PASSES:
+            print(f"pre_clean_html_{backend}: {BACKEND_PASSES[backend]}")
+    report = run_suite(pages, repeat=args.repeat, memory=not args.no_memory)
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_reports(report, json.load(f), args.threshold)
+        for r in regressions:
+            print("regression:", r)
+        sys.exit(1 if regressions else 0)
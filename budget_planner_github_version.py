@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import math
+import uuid
+
+import ollama
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import get_encoding
+from prompt_template_github_version import build_prompt
+
+# -------------------------
+# Model context and tokenizer
+# -------------------------
+# Page sizes are counted with the GPT-4 tokenizer (tiktoken), which the served
+# models do not use. TOKEN_RATIOS holds the model tokens per GPT-4 token on
+# HTML, by model family, on the safe side; calibrate_token_ratio measures it
+# on the server instead. CONTEXT_LENGTHS is the fallback when ollama.show has
+# no context length for a model.
+
+DEFAULT_CONTEXT_LENGTH = 4096
+CONTEXT_LENGTHS = {
+    "gemma3:1b": 32768,
+    "gemma3": 131072,
+    "llama3.2": 131072,
+    "llama3.1": 131072,
+    "dolphin3": 131072,
+    "qwen3": 40960,
+    "deepseek-r1": 131072,
+    "mistral-nemo": 1024000,
+    "phi3:medium": 4096,
+    "phi3": 4096,
+}
+
+DEFAULT_TOKEN_RATIO = 1.5
+TOKEN_RATIOS = {
+    "gemma3": 1.05,
+    "llama3.2": 1.05,
+    "llama3.1": 1.05,
+    "dolphin3": 1.05,
+    "qwen3": 1.1,
+    "deepseek-r1": 1.1,
+    "mistral-nemo": 1.15,
+    "phi3": 1.5,
+}
+
+# Tokens added around the prompt by the model's chat template
+TEMPLATE_MARGIN = 64
+
+# num_ctx is rounded up to a multiple of this
+NUM_CTX_STEP = 256
+
+def _lookup(table, model, default):
+    # Longest key that the model name starts with, so "gemma3:1b" wins over "gemma3"
+    keys = [k for k in table if model.startswith(k)]
+    return table[max(keys, key=len)] if keys else default
+
+def context_length(model, host=None) -> int:
+    """Trained context length of ``model`` from the server's model metadata,
+    else from CONTEXT_LENGTHS."""
+    try:
+        info = ollama.Client(host=host).show(model).modelinfo or {}
+    except (ollama.ResponseError, ConnectionError):
+        info = {}
+    arch = info.get("general.architecture")
+    if arch and info.get(f"{arch}.context_length"):
+        return int(info[f"{arch}.context_length"])
+    return _lookup(CONTEXT_LENGTHS, model, DEFAULT_CONTEXT_LENGTH)
+
+def calibrate_token_ratio(model, texts, host=None) -> float:
+    """Largest ratio of the tokens ``model`` evaluates to GPT-4 tokens over
+    ``texts``, measured with one num_predict=1 request per text. A random
+    first line keeps the server from serving any of it from the KV cache."""
+    client = ollama.Client(host=host)
+    encoding = get_encoding("gpt-4")
+    # Every prompt is tokenized exactly as sent, random line included
+    nonce = uuid.uuid4().hex
+    empty = client.generate(model=model, prompt=nonce, options={"num_predict": 1})
+    baseline = (empty.get("prompt_eval_count") or 0) - len(encoding.encode(nonce))
+    ratio = 0.0
+    for text in texts:
+        prompt = uuid.uuid4().hex + "\n" + text
+        result = client.generate(model=model, prompt=prompt, options={"num_predict": 1})
+        counted = (result.get("prompt_eval_count") or 0) - baseline
+        reference = len(encoding.encode(prompt))
+        if reference:
+            ratio = max(ratio, counted / reference)
+    return ratio or DEFAULT_TOKEN_RATIO
+
+# -------------------------
+# Budget plan
+# -------------------------
+def plan_budget(model, num_predict=750, prompt_version="v4", max_num_ctx=None, token_ratio=None, host=None) -> dict:
+    """
+    Token budget of one model. The prompt template (without page), the chat
+    template margin and ``num_predict`` are reserved from the context window,
+    optionally capped at ``max_num_ctx`` to bound the KV cache; what is left
+    is the page budget, in GPT-4 tokens so it can be compared to the manifest
+    token counts and passed to truncate_html_to_tokens_merged. ``token_ratio``
+    overrides TOKEN_RATIOS (e.g. from calibrate_token_ratio).
+    """
+    ctx = context_length(model, host=host)
+    window = min(ctx, max_num_ctx) if max_num_ctx else ctx
+    ratio = token_ratio or _lookup(TOKEN_RATIOS, model, DEFAULT_TOKEN_RATIO)
+    # The character count line grows with the page; 10 digits covers any page
+    template_tokens = len(get_encoding("gpt-4").encode(build_prompt("", 10 ** 9, version=prompt_version)))
+    reserved = math.ceil(template_tokens * ratio) + TEMPLATE_MARGIN + num_predict
+    if reserved >= window:
+        raise ValueError(f"{model}: context window of {window} tokens leaves no room for the page "
+                         f"({reserved} tokens reserved)")
+    return {
+        "model": model,
+        "context_length": ctx,
+        "window": window,
+        "token_ratio": ratio,
+        "template_tokens": template_tokens,
+        "num_predict": num_predict,
+        "page_budget": int((window - reserved) / ratio),
+    }
+
+def page_tokens_for(plan, page_tokens) -> int:
+    """GPT-4 token count a page of ``page_tokens`` is truncated to under ``plan``."""
+    return min(page_tokens, plan["page_budget"])
+
+def request_num_ctx(plan, page_tokens) -> int:
+    """Smallest num_ctx (rounded up to NUM_CTX_STEP) holding the prompt for a
+    page of ``page_tokens`` GPT-4 tokens, after truncation to the plan, plus
+    num_predict. Never above the plan's window."""
+    prompt = math.ceil((plan["template_tokens"] + page_tokens_for(plan, page_tokens)) * plan["token_ratio"])
+    needed = prompt + TEMPLATE_MARGIN + plan["num_predict"]
+    return min(math.ceil(needed / NUM_CTX_STEP) * NUM_CTX_STEP, plan["window"])
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import math
+import statistics
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from extract_json_github_version import parse_verdict
+
+# -------------------------
+# Small-to-large cascade
+# -------------------------
+# A page goes to the smallest model first and only moves on to the next
+# larger model while the answer is uncertain: no parseable verdict, or a
+# phishing_score inside UNCERTAIN_BAND (inclusive). The answer of the last
+# model a page reaches is final.
+
+UNCERTAIN_BAND = (3, 7)
+
+def verdict_of(analysis_result):
+    """(phishing_score, is_phishing) of a model output, parsed as in
+    extract_json_batch; None where missing."""
+    _, _, score, label, _ = parse_verdict(analysis_result)
+    try:
+        score = float(score)
+    except (TypeError, ValueError, OverflowError):
+        score = None
+    if score is not None and not math.isfinite(score):
+        score = None
+    return score, label
+
+def needs_escalation(analysis_result, band=UNCERTAIN_BAND) -> bool:
+    score, _ = verdict_of(analysis_result)
+    return score is None or band[0] <= score <= band[1]
+
+def replay_cascade(records, models, band=UNCERTAIN_BAND, run=0, page_runs=1) -> dict:
+    """
+    Runs the cascade over ``models`` (smallest first) on result-log records
+    (ResultLog.records, or the records of a full sweep to tune ``band``
+    offline), using run ``run`` of every page. Returns per-stage escalation
+    rates, the final answers' accuracy against True_Phish_Label, and the
+    requests and seconds (summed ``runtime``) of the cascade against the full
+    sweep of every page through every model ``page_runs`` times. Sweep
+    seconds of a model are exact when every (page, run) has a record for it,
+    else estimated from its mean runtime (sweep_seconds_estimated).
+    """
+    by_key = {(r["model"], r["dataset"], r["pageID"]): r for r in records if r["run"] == run}
+    pages = sorted({(d, p) for (m, d, p) in by_key if m == models[0]})
+
+    stages, final = [], {}
+    pending = pages
+    cascade_seconds = 0.0
+    for m in models:
+        if not pending:
+            break
+        escalated, seconds, missing = [], 0.0, 0
+        for page in pending:
+            record = by_key.get((m,) + page)
+            if record is None:
+                missing += 1
+                continue
+            seconds += record["runtime"]
+            final[page] = record
+            if needs_escalation(record["analysis_result"], band) and m != models[-1]:
+                escalated.append(page)
+        stages.append({
+            "model": m,
+            "pages_in": len(pending),
+            "missing": missing,
+            "escalated": len(escalated),
+            "escalation_rate": len(escalated) / (len(pending) - missing) if len(pending) > missing else 0.0,
+            "seconds": seconds,
+        })
+        cascade_seconds += seconds
+        pending = escalated
+
+    runtimes = {(r["model"], r["dataset"], r["pageID"], r["run"]): r["runtime"] for r in records}
+    sweep_seconds, estimated = 0.0, False
+    for m in models:
+        known = [runtimes[(m,) + page + (i,)] for page in pages for i in range(page_runs)
+                 if (m,) + page + (i,) in runtimes]
+        missing = len(pages) * page_runs - len(known)
+        if missing:
+            estimated = True
+        sweep_seconds += sum(known) + (statistics.mean(known) if known else 0.0) * missing
+
+    correct = unparsed = 0
+    for record in final.values():
+        score, label = verdict_of(record["analysis_result"])
+        if label is None:
+            unparsed += 1
+        elif label == record["True_Phish_Label"]:
+            correct += 1
+
+    cascade_requests = sum(s["pages_in"] - s["missing"] for s in stages)
+    sweep_requests = len(pages) * len(models) * page_runs
+    return {
+        "band": list(band),
+        "pages": len(pages),
+        "stages": stages,
+        "accuracy": correct / len(final) if final else None,
+        "unparsed_rate": unparsed / len(final) if final else None,
+        "cascade_requests": cascade_requests,
+        "sweep_requests": sweep_requests,
+        "requests_saved": sweep_requests - cascade_requests,
+        "cascade_seconds": cascade_seconds,
+        "sweep_seconds": sweep_seconds,
+        "sweep_seconds_estimated": estimated,
+        "seconds_saved": sweep_seconds - cascade_seconds,
+    }
+
+
+if __name__ == "__main__":
+    # Usage: cascade_github_version.py RESULTS_LOG MODEL [MODEL ...]
+    # Replays the cascade over a full-sweep log for a few uncertain bands,
+    # against a sweep with as many runs per page as the log holds
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    page_runs = max(r["run"] for r in records) + 1
+    for band in [(5, 5), (4, 6), (3, 7), (2, 8), (1, 9)]:
+        report = replay_cascade(records, sys.argv[2:], band=band, page_runs=page_runs)
+        print(json.dumps({k: v for k, v in report.items() if k != "stages"}))
+        for stage in report["stages"]:
+            print("   ", stage)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from bs4 import BeautifulSoup, Tag
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import *
+
+# Equivalence check of the pre_clean_html parser backends against html.parser.
+#
+# Each cleaned and truncated output is classified as
+#   "identical"  - byte-identical to the html.parser output
+#   "normalized" - identical after the documented normalizations below
+#   "differs"    - anything else (reported with the document name; run as a
+#                  script, the check then exits with status 1)
+#
+# Documented normalizations (lxml and selectolax build the tree the way
+# browsers do, html.parser keeps the markup as written):
+#   1. <html>, <head> and <body> are always present; they are ignored.
+#   2. Doctype and whitespace-only text between tags may be dropped or moved.
+#   3. Attributes are compared as values, not as serialized text (quoting and
+#      entity escaping differ).
+#   4. Text is compared as the sequence of stripped strings, so text that the
+#      HTML5 rules move into or out of an implied element still matches.
+# Misnested markup that HTML5 tree construction reorders (e.g. foster-parented
+# table content) is reported as "differs".
+#
+# The truncated stages count tokens with tiktoken, which downloads its
+# encoding file (cl100k_base for gpt-4) on first use and caches it (see
+# TIKTOKEN_CACHE_DIR). When the file can be neither loaded nor downloaded,
+# the script compares the cleaned output only and says so.
+
+STRUCTURAL_TAGS = {"html", "head", "body"}
+
+def normalized_view(html: str) -> list:
+    soup = BeautifulSoup(html, "html.parser")
+    view = []
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            if node.name not in STRUCTURAL_TAGS:
+                attrs = sorted((k, " ".join(v) if isinstance(v, list) else v) for k, v in node.attrs.items())
+                view.append((node.name, tuple(attrs)))
+        elif type(node) in Tag.MAIN_CONTENT_STRING_TYPES and node.strip():
+            view.append(("#text", node.strip()))
+    return view
+
+def classify(reference: str, candidate: str) -> str:
+    if reference == candidate:
+        return "identical"
+    if normalized_view(reference) == normalized_view(candidate):
+        return "normalized"
+    return "differs"
+
+def token_counts_available(model: str = "gpt-4") -> bool:
+    try:
+        get_encoding(model)
+    except Exception:
+        return False
+    return True
+
+def compare_backends(pages: dict, levels=(0.05, 0.5), backends=None) -> dict:
+    """
+    Runs pre_clean_html and truncate_html_to_tokens_multi with every backend
+    on ``pages`` ({name: html}) and counts the classification per backend and
+    stage. Returns {backend: {stage: {classification: count}}, "differs": [...]}.
+    With no ``levels`` only pre_clean_html is compared, without token counts.
+    """
+    encoding = get_encoding("gpt-4") if levels else None
+    backends = [b for b in (backends or available_parser_backends()) if b != "html.parser"]
+    report = {b: {} for b in backends}
+    report["differs"] = []
+
+    for name, html in pages.items():
+        budgets = [len(encoding.encode(html)) * level for level in levels]
+        reference = [str(pre_clean_html(html))]
+        if budgets:
+            reference += truncate_html_to_tokens_multi(html, budgets)
+        for backend in backends:
+            candidate = [str(pre_clean_html(html, backend))]
+            if budgets:
+                candidate += truncate_html_to_tokens_multi(html, budgets, parser=backend)
+            stages = ["cleaned"] + [f"truncated_{level}" for level in levels]
+            for stage, ref, cand in zip(stages, reference, candidate):
+                result = classify(ref, cand)
+                counts = report[backend].setdefault(stage, {})
+                counts[result] = counts.get(result, 0) + 1
+                if result == "differs":
+                    report["differs"].append((backend, stage, name))
+    return report
+
+def sample_pages() -> dict:
+    return {
+        "simple": "<html><head><title>Sign in</title></head><body><p>Welcome</p><a href='/login'>Login</a></body></html>",
+        "fragment": "<div><p>Verify your account</p><img src='logo.png' alt='logo'></div>",
+        "scripts": "<html><head><script>var a = '<p>';</script><style>p{color:red}</style></head>"
+                   "<body><!-- hidden --><h1>Bank</h1><form><input name='pw'><button>Go</button></form></body></html>",
+        "entities": "<p>Tom &amp; Jerry &lt;3</p><a href='https://example.com/?a=1&amp;b=2'>link</a>",
+        "long_urls": "<a href='https://very-long-domain.example.com/" + "x" * 80 + "'>x</a>"
+                     "<img src='data:image/png;base64," + "A" * 300 + "'>",
+        "unclosed": "<html><body><ul><li>one<li>two</ul><p>para<p>next</body></html>",
+    }
+
+def stream_pages() -> dict:
+    # Markup the stream backend must read like html.parser, also across
+    # chunk boundaries: comments html.parser never closes, so it keeps them
+    # and what follows as text (lxml and selectolax follow the HTML5 comment
+    # rules instead), and end markers split over several chunks
+    return {
+        "bad_comment_close": "<p>pre</p><!-- a --!> b<p>post</p>",
+        "open_comment": "<p>pre</p><!-- open<p>post</p>",
+        # Ends of comments and scripts spread over many chunks
+        "spaced_comment_end": "<p>a</p><!-- x --" + " " * 200 + "><p>b</p>",
+        "spaced_script_end": "<p>a</p><script>x</script" + " " * 200 + "><p>b</p>",
+    }
+
+def compare_stream_chunks(pages: dict, chunk_sizes=(1, 7, 64)) -> dict:
+    """
+    pre_clean_html on the output of stream_pre_clean at small chunk sizes
+    against pre_clean_html on the page, so that markup split over chunk
+    boundaries is read the same way. Returns the same report shape as
+    compare_backends, with one stage per chunk size.
+    """
+    from stream_pre_clean_github_version import stream_pre_clean
+    counts, differs = {}, []
+    for name, html in pages.items():
+        reference = str(pre_clean_html(html))
+        for chunk_size in chunk_sizes:
+            stage = f"chunk_size_{chunk_size}"
+            result = classify(reference, str(pre_clean_html(stream_pre_clean(html, chunk_size=chunk_size))))
+            counts.setdefault(stage, {})
+            counts[stage][result] = counts[stage].get(result, 0) + 1
+            if result != "identical":
+                differs.append(("stream", stage, name))
+    return {"stream": counts, "differs": differs}
+
+def folder_pages(path: str, limit: int = 200) -> dict:
+    pages = {}
+    for folder in sorted(os.listdir(path))[:limit]:
+        folder_path = os.path.join(path, folder)
+        for f1 in sorted(os.listdir(folder_path)):
+            if f1.endswith(".html"):
+                with open(os.path.join(folder_path, f1), "r", encoding="utf-8") as f:
+                    pages[f"{folder}/{f1}"] = f.read()
+    return pages
+
+
+if __name__ == "__main__":
+    # Optional: path to a dataset folder (one sub-folder per page)
+    pages = folder_pages(sys.argv[1]) if len(sys.argv) > 1 else sample_pages()
+    levels = (0.05, 0.5)
+    if not token_counts_available():
+        print("tiktoken encoding not available: comparing the cleaned output only")
+        levels = ()
+    report = compare_backends(pages, levels)
+    if len(sys.argv) == 1:
+        stream_report = compare_backends(stream_pages(), levels, backends=["stream"])
+        report["stream (stream_pages)"] = stream_report["stream"]
+        report["differs"] += stream_report["differs"]
+        chunk_report = compare_stream_chunks(stream_pages())
+        report["stream (small chunks)"] = chunk_report["stream"]
+        report["differs"] += chunk_report["differs"]
+    for backend, stages in report.items():
+        if backend != "differs":
+            print(backend, stages)
+    for backend, stage, name in report["differs"]:
+        print("differs:", backend, stage, name)
+    # Non-zero exit on any "differs", so the check can gate a change
+    sys.exit(1 if report["differs"] else 0)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import mmap
+import sys
+import hashlib
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import get_encoding
+from token_counting_github_version import iter_token_counts
+
+# A manifest describes a dataset without holding its pages in memory: one
+# entry per page with
+#   doc_name     - folder name, or "folder/file.html" if a folder holds
+#                  more than one .html file
+#   path, offset, size - where the page bytes live (offset is 0 for pages
+#                  stored as whole files, the line offset for JSONL records)
+#   format       - "html" for a page file, "jsonl" for a {"doc_name", "html"} line
+#   mtime        - change detection for incremental rebuilds
+#   sha256       - content hash of the page text
+#   tokenizer, token_count - tokens of the page for the manifest's tokenizer
+# Manifests are stored as JSONL next to the dataset and reused as long as
+# the files they describe are unchanged.
+
+# -------------------------
+# Reading pages
+# -------------------------
+def read_page(entry: dict) -> str:
+    """Reads one page through a memory map of its file."""
+    if entry["size"] == 0:
+        return ""
+    with open(entry["path"], "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[entry["offset"]:entry["offset"] + entry["size"]]
+    if entry["format"] == "jsonl":
+        return json.loads(data)["html"]
+    # Same newline handling as reading the file in text mode
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def iter_pages(entries: list):
+    """Yields (doc_name, html) one page at a time."""
+    for entry in entries:
+        yield entry["doc_name"], read_page(entry)
+
+# -------------------------
+# Manifest files
+# -------------------------
+def load_manifest(manifest_path: str) -> list:
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_manifest(entries: list, manifest_path: str) -> None:
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    os.replace(tmp_path, manifest_path)
+
+def _page_entry(doc_name: str, path: str, offset: int, size: int, fmt: str, mtime: float, encoding) -> dict:
+    # sha256 and token_count are filled in by fill_token_counts
+    return {
+        "doc_name": doc_name,
+        "path": path,
+        "offset": offset,
+        "size": size,
+        "format": fmt,
+        "mtime": mtime,
+        "sha256": None,
+        "tokenizer": encoding.name,
+        "token_count": None,
+    }
+
+def fill_token_counts(entries: list, model: str = "gpt-4", cache=None, num_threads: int = None) -> None:
+    """
+    Sets sha256 and token_count on every entry that lacks them. Each page is
+    read once: it is hashed, its count taken from ``cache`` where possible,
+    and otherwise counted in multi-threaded batches with pages read lazily
+    (see token_counting_github_version.iter_token_counts).
+    """
+    encoding = get_encoding(model)
+    counted = []
+
+    def pages_to_count():
+        for entry in entries:
+            if entry.get("sha256") is not None and entry.get("token_count") is not None:
+                continue
+            page = read_page(entry)
+            entry["sha256"] = hashlib.sha256(page.encode("utf-8")).hexdigest()
+            token_count = cache.get_token_count(entry["sha256"], encoding.name) if cache else None
+            if token_count is not None:
+                entry["token_count"] = token_count
+                continue
+            counted.append(entry)
+            yield page
+
+    # A page is appended to ``counted`` before it is handed to the tokenizer,
+    # so the i-th count always belongs to counted[i]
+    for i, token_count in enumerate(iter_token_counts(pages_to_count(), model, num_threads)):
+        entry = counted[i]
+        entry["token_count"] = token_count
+        if cache:
+            cache.put_token_count(entry["sha256"], encoding.name, token_count)
+
+# -------------------------
+# Page folders
+# -------------------------
+def build_manifest(folder: str, manifest_path: str = None, model: str = "gpt-4", cache=None) -> list:
+    """
+    Manifest of a dataset folder with one sub-folder per website holding its
+    .html file(s), like /workspace/dataset/unpacked_folder_phishing. Entries
+    of files whose size and mtime did not change are reused from the
+    existing manifest, so only new or modified pages are read; their token
+    counts come from ``cache`` (a PreprocessingCache) when it has them and
+    are otherwise counted in batches by fill_token_counts.
+    """
+    manifest_path = manifest_path or folder.rstrip("/") + ".manifest.jsonl"
+    encoding = get_encoding(model)
+    previous = {e["path"]: e for e in load_manifest(manifest_path) if e.get("tokenizer") == encoding.name}
+
+    entries = []
+    # Directory order as in the original loader, so that the sampling over the
+    # resulting DataFrame picks the same documents
+    for filename in os.listdir(folder):
+        p2 = os.path.join(folder, filename).replace("\\", "/")
+        if not os.path.isdir(p2):
+            continue
+        html_files = sorted(f1 for f1 in os.listdir(p2) if f1.endswith(".html"))
+        for f1 in html_files:
+            file_path = os.path.join(p2, f1).replace("\\", "/")
+            doc_name = filename if len(html_files) == 1 else f"{filename}/{f1}"
+            stat = os.stat(file_path)
+            entry = previous.get(file_path)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                entry = _page_entry(doc_name, file_path, 0, stat.st_size, "html", stat.st_mtime, encoding)
+            entry["doc_name"] = doc_name
+            entries.append(entry)
+
+    fill_token_counts(entries, model, cache)
+    save_manifest(entries, manifest_path)
+    return entries
+
+# -------------------------
+# {name: html} JSON datasets
+# -------------------------
+def build_record_manifest(json_path: str, model: str = "gpt-4", cache=None) -> list:
+    """
+    Manifest of a {doc_name: html} JSON file such as phish_5_url.json. The
+    file is converted once into a JSONL sidecar (``<json_path>l``) with one
+    {"doc_name", "html"} record per line; the manifest points at the byte
+    range of every line, so single pages are read without loading the rest.
+    """
+    jsonl_path = json_path + "l"
+    manifest_path = json_path + ".manifest.jsonl"
+    encoding = get_encoding(model)
+
+    stat = os.stat(json_path)
+    entries = load_manifest(manifest_path)
+    if entries and entries[0].get("source_mtime") == stat.st_mtime and entries[0].get("tokenizer") == encoding.name:
+        return entries
+
+    with open(json_path, "r") as file:
+        records = json.load(file)
+    with open(jsonl_path, "w", encoding="utf-8") as out:
+        for doc_name, html in records.items():
+            out.write(json.dumps({"doc_name": doc_name, "html": html}) + "\n")
+    del records
+
+    entries = []
+    jsonl_mtime = os.stat(jsonl_path).st_mtime
+    with open(jsonl_path, "rb") as f:
+        offset = 0
+        for line in f:
+            doc_name = json.loads(line)["doc_name"]
+            entry = _page_entry(doc_name, jsonl_path, offset, len(line.rstrip(b"\n")), "jsonl", jsonl_mtime, encoding)
+            entry["source_mtime"] = stat.st_mtime
+            entries.append(entry)
+            offset += len(line)
+
+    fill_token_counts(entries, model, cache)
+    save_manifest(entries, manifest_path)
+    return entries
+
+def merge_manifests(*manifests) -> list:
+    """Entries of several manifests; a later manifest wins for a repeated
+    doc_name, like dict.update on the loaded datasets."""
+    merged = {}
+    for entries in manifests:
+        merged.update({e["doc_name"]: e for e in entries})
+    return list(merged.values())
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import asyncio
+from collections import deque
+
+import httpx
+import ollama
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from local_llm_inference_github_version import *
+from model_lifecycle_github_version import preload_model_async, unload_model_async
+
+# -------------------------
+# Multi-endpoint pool
+# -------------------------
+# Work units (dicts with a "model" key) are sharded over several Ollama
+# hosts. Every endpoint keeps one deque of units per model it serves and runs
+# ``slots`` workers (keep at or below its OLLAMA_NUM_PARALLEL). A worker takes
+# the next unit of the model its endpoint is on; when its own deque of that
+# model is empty it steals from the back of the fullest deque of another
+# endpoint serving the model, and only when no endpoint has work left for
+# that model does it switch to the model with the most work left, so models
+# are not swapped in and out of memory for every unit. An endpoint that fails
+# a request backs off exponentially (a success resets it) and the unit goes to
+# the front of the healthiest endpoint serving its model. Workers with nothing
+# to take wait while any request is in flight, since a failed one is put back,
+# and exit only once every queue is empty and nothing is in flight. A host
+# that cannot be listed at the start serves nothing in the sweep.
+#
+# Before the first timed request of a model on an endpoint, the model is
+# loaded, pinned with ``keep_alive`` and warmed up (as in ModelSession), so
+# no result includes load time. It is unloaded once the endpoint has moved on
+# and no queue holds work for it, and at the end of the run otherwise.
+
+# Errors that mark an endpoint unhealthy rather than a bad request
+ENDPOINT_ERRORS = (ConnectionError, httpx.TransportError, asyncio.TimeoutError)
+
+class Endpoint:
+
+    def __init__(self, host, models=None, slots=4, backoff=1.0, max_backoff=60.0):
+        self.host = host
+        self.client = ollama.AsyncClient(host=host)
+        # None: every model of the host (from /api/tags on first use)
+        self.models = list(models) if models is not None else None
+        self.slots = slots
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queues = {}
+        self.current = None
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.served = 0
+        # model -> requests in flight on this endpoint
+        self.active = {}
+        # model -> preload task; the model is loaded while it is in here
+        self.sessions = {}
+        self.load_reports = {}
+
+    def failed(self) -> None:
+        self.failures += 1
+        self.backoff_until = time.time() + min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+
+    def succeeded(self) -> None:
+        self.failures = 0
+        self.backoff_until = 0.0
+
+    def pending(self, model) -> int:
+        return len(self.queues.get(model, ()))
+
+
+def _take(endpoint, endpoints, model):
+    """Next unit of ``model`` for ``endpoint``: its own oldest, else the
+    newest of the endpoint with the most left (stolen)."""
+    if endpoint.pending(model):
+        return endpoint.queues[model].popleft()
+    victims = [e for e in endpoints if e is not endpoint and e.pending(model)]
+    if victims:
+        return max(victims, key=lambda e: e.pending(model)).queues[model].pop()
+    return None
+
+def _has_work(endpoint, endpoints) -> bool:
+    return any(e.pending(m) for e in endpoints for m in endpoint.models)
+
+def _next_unit(endpoint, endpoints):
+    if endpoint.current is not None:
+        unit = _take(endpoint, endpoints, endpoint.current)
+        if unit is not None:
+            return unit
+    left = {m: sum(e.pending(m) for e in endpoints) for m in endpoint.models}
+    left = {m: n for m, n in left.items() if n}
+    if not left:
+        return None
+    endpoint.current = max(left, key=left.get)
+    return _take(endpoint, endpoints, endpoint.current)
+
+async def _request(endpoint, unit, prompt_text, max_tokens, keep_alive, json_mode, num_ctx):
+    if json_mode is None:
+        return await local_llm_infer_v2_async(prompt_text, max_tokens=max_tokens, model=unit["model"],
+                                              client=endpoint.client, timings=True, keep_alive=keep_alive,
+                                              num_ctx=num_ctx)
+    return await local_llm_infer_v2_json_async(prompt_text, max_tokens=max_tokens, model=unit["model"],
+                                               client=endpoint.client, structured=json_mode == "structured",
+                                               keep_alive=keep_alive, num_ctx=num_ctx)
+
+async def _warm(endpoint, model, keep_alive, num_ctx):
+    # Preloads and warms up ``model`` once per endpoint; every worker that
+    # needs it waits for the same preload
+    task = endpoint.sessions.get(model)
+    if task is None:
+        task = endpoint.sessions[model] = asyncio.ensure_future(
+            preload_model_async(endpoint.client, model, keep_alive=keep_alive, num_ctx=num_ctx))
+    try:
+        endpoint.load_reports[model] = await task
+    except BaseException:
+        if endpoint.sessions.get(model) is task:
+            del endpoint.sessions[model]
+        raise
+
+async def _unload(endpoint, model):
+    del endpoint.sessions[model]
+    try:
+        endpoint.load_reports.setdefault(model, {"model": model})["unload_wall_time"] = \
+            await unload_model_async(endpoint.client, model)
+    except ENDPOINT_ERRORS + (ollama.ResponseError,):
+        pass
+
+async def _release(endpoint, endpoints):
+    # Unloads the models the endpoint has moved on from and that no queue
+    # holds work for any more
+    for model in list(endpoint.sessions):
+        if model != endpoint.current and not endpoint.active.get(model) \
+                and not any(e.pending(model) for e in endpoints) and endpoint.sessions[model].done():
+            await _unload(endpoint, model)
+
+async def _pool(units, endpoints, on_result, prompt_of, max_tokens, keep_alive, json_mode, num_ctx, max_attempts,
+                warmup):
+    unreachable = []
+    for endpoint in endpoints:
+        if endpoint.models is None:
+            try:
+                endpoint.models = [m["model"] for m in (await endpoint.client.list())["models"]]
+            except ENDPOINT_ERRORS as e:
+                # Serves nothing in this run; its share goes to the other endpoints
+                endpoint.models = []
+                unreachable.append((endpoint.host, str(e)))
+
+    failed = []
+    attempts = {}
+
+    # Shard: every unit goes to the least loaded endpoint serving its model
+    for unit in units:
+        serving = [e for e in endpoints if unit["model"] in e.models]
+        if not serving:
+            if not unreachable:
+                raise ValueError(f"No endpoint serves model {unit['model']!r}")
+            failed.append((unit, f"no reachable endpoint serves model {unit['model']!r}"))
+            continue
+        target = min(serving, key=lambda e: sum(len(q) for q in e.queues.values()))
+        target.queues.setdefault(unit["model"], deque()).append(unit)
+
+    in_flight = 0
+    changed = asyncio.Condition()
+
+    async def take(endpoint):
+        # Next unit for ``endpoint``, waiting out its backoff; while requests
+        # are in flight a worker with nothing to do waits, since a failed
+        # request is put back. None once there is no work left for it.
+        nonlocal in_flight
+        async with changed:
+            while True:
+                wait = endpoint.backoff_until - time.time()
+                if wait <= 0:
+                    unit = _next_unit(endpoint, endpoints)
+                    if unit is not None:
+                        in_flight += 1
+                        endpoint.active[unit["model"]] = endpoint.active.get(unit["model"], 0) + 1
+                        return unit
+                if not in_flight and not _has_work(endpoint, endpoints):
+                    return None
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def finish(endpoint, unit):
+        nonlocal in_flight
+        async with changed:
+            in_flight -= 1
+            endpoint.active[unit["model"]] -= 1
+            changed.notify_all()
+
+    async def worker(endpoint):
+        while True:
+            unit = await take(endpoint)
+            if unit is None:
+                return
+            try:
+                model_ctx = num_ctx.get(unit["model"]) if isinstance(num_ctx, dict) else num_ctx
+                try:
+                    if warmup:
+                        await _release(endpoint, endpoints)
+                        await _warm(endpoint, unit["model"], keep_alive, model_ctx)
+                    prompt_text = prompt_of(unit) if prompt_of else unit["prompt"]
+                    t1 = time.time()
+                    analysis_result, timings = await _request(endpoint, unit, prompt_text, max_tokens, keep_alive,
+                                                              json_mode, model_ctx)
+                except ENDPOINT_ERRORS + (ollama.ResponseError,) as e:
+                    key = id(unit)
+                    attempts[key] = attempts.get(key, 0) + 1
+                    endpoint.failed()
+                    if (isinstance(e, ollama.ResponseError) and e.status_code < 500) or attempts[key] >= max_attempts:
+                        failed.append((unit, f"{endpoint.host}: {e}"))
+                        continue
+                    # Retried first by the healthiest other endpoint serving the model
+                    serving = [o for o in endpoints if unit["model"] in o.models] or [endpoint]
+                    retry = min(serving, key=lambda o: (o.failures, o is endpoint))
+                    retry.queues.setdefault(unit["model"], deque()).appendleft(unit)
+                    continue
+                t2 = time.time()
+                endpoint.succeeded()
+                endpoint.served += 1
+                on_result(unit, analysis_result, t2 - t1, timings, endpoint.host)
+            finally:
+                await finish(endpoint, unit)
+
+    await asyncio.gather(*(worker(e) for e in endpoints for _ in range(e.slots)))
+    for endpoint in endpoints:
+        for model in list(endpoint.sessions):
+            await _unload(endpoint, model)
+    return {
+        "served": {e.host: e.served for e in endpoints},
+        "failed": failed,
+        "unreachable": unreachable,
+        "loads": {e.host: e.load_reports for e in endpoints if e.load_reports},
+    }
+
+def run_pooled_inference(units, endpoints, on_result, prompt_of=None, max_tokens=750, keep_alive=None,
+                         json_mode=None, num_ctx=None, max_attempts=3, warmup=True):
+    """
+    Runs ``units`` (dicts with "model" and, without ``prompt_of``, "prompt")
+    on ``endpoints``: Endpoint objects, or dicts with "host" and optional
+    "models" and "slots". ``prompt_of(unit)`` builds the prompt when the unit
+    is about to be sent. ``on_result(unit, analysis_result, runtime,
+    timings, endpoint)`` gets the host that served the unit; ``runtime`` and
+    ``timings`` are as in run_scheduled_inference. ``num_ctx`` is one value
+    or a dict per model. A unit whose request fails on ``max_attempts``
+    endpoints (or with a 4xx error) is given up. ``warmup`` preloads and
+    warms up each model on each endpoint before its first timed request and
+    unloads it afterwards. Returns {"served": {host: units served}, "failed":
+    [(unit, error)], "unreachable": [(host, error)], "loads": {host: {model:
+    load_report}}}.
+    """
+    endpoints = [e if isinstance(e, Endpoint) else Endpoint(**e) for e in endpoints]
+    return asyncio.run(_pool(list(units), endpoints, on_result, prompt_of, max_tokens, keep_alive, json_mode,
+                             num_ctx, max_attempts, warmup))
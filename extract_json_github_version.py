@@ -4,6 +4,7 @@ import pandas as pd
 import json
 import re
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 def extract_json_from_text(text):
     """
     Try to find and parse a JSON object from the given text.
@@ -81,6 +82,75 @@ def extract_json_from_text2(text):
         except json.JSONDecodeError:
             return None, True  # Found but invalid JSON
 
+# Keys of a complete phishing verdict, as requested by build_html_prompt_v4
+VERDICT_KEYS = ("phishing_score", "is_phishing", "reasoning")
+
+# JSON schema of the verdict, for Ollama's structured output (format=...)
+VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "phishing_score": {"type": "integer", "minimum": 0, "maximum": 10},
+        "is_phishing": {"type": "boolean"},
+        "reasoning": {"type": "string"},
+    },
+    "required": list(VERDICT_KEYS),
+}
+
+class IncrementalJSONDetector:
+    """
+    Consumes model output chunk by chunk and reports as soon as a complete
+    {...} object holding all ``required`` keys has been produced. Braces
+    inside double-quoted strings are ignored. Every closing brace triggers one
+    parse attempt of the span back to its opening brace, with the same
+    single-quote fallback as extract_json_from_text, so stray unmatched braces
+    in the surrounding prose do not hide the verdict; spans that do not parse
+    or lack a key are skipped and scanning goes on.
+    """
+
+    def __init__(self, required=VERDICT_KEYS):
+        self.required = required
+        self.text = ""
+        self.pos = 0
+        self.opened = []
+        self.in_string = False
+        self.escape = False
+        self.result = None
+        self.end = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            self.pos += 1
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.opened:
+                self.in_string = True
+            elif ch == "{":
+                self.opened.append(self.pos - 1)
+            elif ch == "}" and self.opened:
+                start = self.opened.pop()
+                if self._accept(self.text[start:self.pos]):
+                    self.end = self.pos
+                    return True
+        return False
+
+    def _accept(self, candidate):
+        for raw in (candidate, candidate.replace("'", '"')):
+            try:
+                parsed = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, dict) and all(k in parsed for k in self.required):
+                self.result = parsed
+                return True
+        return False
+
 def process_dataframe(df, column="analysis_result"):
     results = []
     for text in df[column]:
@@ -113,3 +183,193 @@ def process_dataframe(df, column="analysis_result"):
     
 
     return df.join(pd.DataFrame(results))
+
+
+# -------------------------
+# Batch extraction
+# -------------------------
+# Same candidates as extract_json_from_text, found without regex backtracking:
+# the first ```json fenced block, else the greedy span from the first "{" to
+# the last "}". When that candidate does not parse, the top-level objects of a
+# brace scanner that skips double-quoted strings are tried, last first, taking
+# the first one with a verdict key (else the last object that parses), so a
+# verdict surrounded by prose with stray braces is still recovered.
+
+_FENCED_RE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+_STRUCTURAL_RE = re.compile(r'["{}\\]')
+
+def _loads(raw):
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        try:
+            return json.loads(raw.replace("'", '"'))
+        except json.JSONDecodeError:
+            return None
+
+def _balanced_objects(text):
+    """(start, end) of every top-level {...} in ``text``, ignoring braces
+    inside double-quoted strings. Jumps between structural characters only."""
+    spans = []
+    depth, start, in_string, skip = 0, 0, False, -1
+    for m in _STRUCTURAL_RE.finditer(text):
+        i = m.start()
+        if i == skip:
+            continue
+        ch = text[i]
+        if in_string:
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = depth > 0
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                spans.append((start, i + 1))
+    return spans
+
+def _as_label(value):
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, str):
+        return {"true": True, "yes": True, "false": False, "no": False}.get(value.strip().lower())
+    return None
+
+def parse_verdict(text):
+    """
+    (is_json, needs_processing, phishing_score, is_phishing, reasoning) of
+    one model output, the row extract_json_batch builds its columns from.
+    phishing_score is the value as the model wrote it; is_phishing is True,
+    False ("true"/"false" and "yes"/"no" strings mapped) or None.
+    """
+    if not isinstance(text, str):
+        return False, False, None, None, None
+    raw = None
+    if "```json" in text:
+        m = _FENCED_RE.search(text)
+        if m:
+            raw = m.group(1)
+    if raw is None:
+        first, last = text.find("{"), text.rfind("}")
+        if first == -1 or last < first:
+            return False, False, None, None, None
+        raw = text[first:last + 1]
+    raw = raw.strip()
+    parsed = _loads(raw)
+    if not isinstance(parsed, dict):
+        parsed = None
+        for start, end in reversed(_balanced_objects(text)):
+            candidate = _loads(text[start:end])
+            if isinstance(candidate, dict) and (parsed is None or any(k in candidate for k in VERDICT_KEYS)):
+                parsed, raw = candidate, text[start:end]
+                if any(k in candidate for k in VERDICT_KEYS):
+                    break
+    # Found JSON that does not cover the whole output, or could not be parsed
+    needs_processing = parsed is None or raw != text.strip()
+    if not parsed:
+        return False, needs_processing, None, None, None
+    return (True, needs_processing, parsed.get("phishing_score"), _as_label(parsed.get("is_phishing")),
+            parsed.get("reasoning"))
+
+def _extract_chunk(texts):
+    return [parse_verdict(t) for t in texts]
+
+def extract_json_batch(texts, workers=None, chunk_size=10000) -> pd.DataFrame:
+    """
+    Extracts the verdict of every model output in ``texts`` (iterable of
+    str, non-strings count as missing) into a DataFrame with one row per
+    text: is_json, needs_processing, phishing_score (Int64; non-integral,
+    non-finite, out-of-range or non-numeric scores are <NA>), is_phishing (boolean; "true"/"false" and
+    "yes"/"no" strings are mapped, anything else is <NA>) and reasoning.
+    Identical outputs are parsed once. With ``workers`` > 1 the distinct
+    outputs are parsed in a process pool, ``chunk_size`` texts per task.
+    """
+    codes, uniques = pd.factorize(pd.Series(list(texts), dtype=object), use_na_sentinel=False)
+    uniques = list(uniques)
+    if workers and workers > 1 and len(uniques) > chunk_size:
+        chunks = [uniques[i:i + chunk_size] for i in range(0, len(uniques), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = [row for chunk in pool.map(_extract_chunk, chunks) for row in chunk]
+    else:
+        rows = _extract_chunk(uniques)
+
+    is_json, needs_processing, scores, labels, reasoning = (list(col) for col in zip(*rows)) if rows else ([],) * 5
+    scores = pd.to_numeric(pd.Series(scores, dtype=object), errors="coerce")
+    # json.loads accepts Infinity, 1e30 and integers of any size, none of
+    # which fit Int64
+    as_float = scores.astype(float)
+    scores = scores.where(np.isfinite(as_float) & (as_float.round() == as_float)
+                          & as_float.between(-2.0 ** 63, 2.0 ** 63, inclusive="left"))
+    table = pd.DataFrame({
+        "is_json": pd.Series(is_json, dtype=bool),
+        "needs_processing": pd.Series(needs_processing, dtype=bool),
+        "phishing_score": scores.astype("Int64"),
+        "is_phishing": pd.Series(labels, dtype="boolean"),
+        "reasoning": pd.Series(reasoning, dtype=object),
+    })
+    return table.take(codes).reset_index(drop=True)
+
+def process_dataframe_batch(df, column="analysis_result", workers=None) -> pd.DataFrame:
+    """process_dataframe on extract_json_batch: same columns, typed, with
+    needs_processing set when the JSON found does not span the whole
+    (stripped) output or does not parse."""
+    return df.join(extract_json_batch(df[column], workers=workers).set_axis(df.index))
+
+# -------------------------
+# Batch vs row check
+# -------------------------
+# Outputs the batch path must type the way the row path (process_dataframe)
+# reads them; run as a script, a mismatch exits with status 1.
+SAMPLE_OUTPUTS = [
+    '{"phishing_score": 8, "is_phishing": true, "reasoning": "login form"}',
+    '```json\n{"phishing_score": 2, "is_phishing": false, "reasoning": "blog"}\n```',
+    'Verdict: {"phishing_score": 6.5, "is_phishing": "yes", "reasoning": "odd"} done',
+    "{'phishing_score': '7', 'is_phishing': 'no', 'reasoning': 'quotes'}",
+    '{"phishing_score": Infinity, "is_phishing": true, "reasoning": "inf"}',
+    '{"phishing_score": -Infinity, "is_phishing": true, "reasoning": "-inf"}',
+    '{"phishing_score": NaN, "is_phishing": true, "reasoning": "nan"}',
+    '{"phishing_score": 1e30, "is_phishing": true, "reasoning": "huge float"}',
+    '{"phishing_score": 99999999999999999999999, "is_phishing": true, "reasoning": "huge int"}',
+    '{"phishing_score": "high", "is_phishing": "maybe", "reasoning": "words"}',
+    "no json here",
+    None,
+]
+
+def _expected_score(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return pd.NA
+    if not np.isfinite(number) or number != round(number) or not -2.0 ** 63 <= number < 2.0 ** 63:
+        return pd.NA
+    return int(number)
+
+def compare_batch_with_rows(texts) -> list:
+    """Indices of ``texts`` where extract_json_batch disagrees with
+    process_dataframe on is_json or phishing_score."""
+    frame = pd.DataFrame({"analysis_result": list(texts)})
+    rows = process_dataframe(frame)
+    batch = extract_json_batch(frame["analysis_result"])
+    mismatches = []
+    for i in range(len(frame)):
+        expected = _expected_score(rows["phishing_score"][i]) if rows["is_json"][i] else pd.NA
+        got = batch["phishing_score"][i]
+        same_score = got is pd.NA if expected is pd.NA else got == expected
+        if bool(rows["is_json"][i]) != bool(batch["is_json"][i]) or not same_score:
+            mismatches.append(i)
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+    mismatches = compare_batch_with_rows(SAMPLE_OUTPUTS)
+    for i in mismatches:
+        print("differs:", repr(SAMPLE_OUTPUTS[i]))
+    print(f"{len(SAMPLE_OUTPUTS) - len(mismatches)}/{len(SAMPLE_OUTPUTS)} outputs agree")
+    sys.exit(1 if mismatches else 0)
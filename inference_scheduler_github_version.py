@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import asyncio
+from collections import deque
+
+import ollama
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from local_llm_inference_github_version import *
+
+# -------------------------
+# Concurrent inference scheduler
+# -------------------------
+# Keep concurrency at or below the server's parallel slots (OLLAMA_NUM_PARALLEL):
+# requests beyond that wait in Ollama's own queue, and that wait would be
+# counted in the runtime.
+
+# json_mode: None runs every request to completion, "early_stop" stops each
+# stream once the verdict JSON is complete, "structured" additionally
+# constrains the output with VERDICT_SCHEMA
+JSON_MODES = (None, "early_stop", "structured")
+
+def model_concurrency_of(model, concurrency=4, model_concurrency=None) -> int:
+    """Requests in flight for ``model``: from ``model_concurrency`` (a dict
+    keyed by model or a callable taking the model and returning None for the
+    default), else ``concurrency``."""
+    if callable(model_concurrency):
+        limit = model_concurrency(model)
+    else:
+        limit = (model_concurrency or {}).get(model)
+    return concurrency if limit is None else limit
+
+async def _timed_request(client, semaphore, prompt_text, model, max_tokens, keep_alive, json_mode, num_ctx):
+    async with semaphore:
+        # The clock starts once a slot is free, so waiting for a slot is not
+        # part of the request's runtime
+        t1 = time.time()
+        if json_mode is None:
+            analysis_result, timings = await local_llm_infer_v2_async(prompt_text, max_tokens=max_tokens, model=model,
+                                                                      client=client, timings=True,
+                                                                      keep_alive=keep_alive, num_ctx=num_ctx)
+        else:
+            analysis_result, timings = await local_llm_infer_v2_json_async(prompt_text, max_tokens=max_tokens,
+                                                                           model=model, client=client,
+                                                                           structured=json_mode == "structured",
+                                                                           keep_alive=keep_alive, num_ctx=num_ctx)
+        t2 = time.time()
+    return analysis_result, t2 - t1, timings
+
+async def _schedule(units, model, on_result, concurrency, max_tokens, host, ordered, keep_alive, json_mode, num_ctx):
+    client = ollama.AsyncClient(host=host)
+    semaphore = asyncio.Semaphore(concurrency)
+    in_flight = deque()
+    completed = 0
+
+    async def run_unit(unit):
+        result = await _timed_request(client, semaphore, unit["prompt"], model, max_tokens, keep_alive, json_mode,
+                                     num_ctx)
+        if not ordered:
+            on_result(unit, *result)
+        return result
+
+    async def finish_oldest():
+        unit, task = in_flight.popleft()
+        result = await task
+        if ordered:
+            on_result(unit, *result)
+
+    for unit in units:
+        task = asyncio.ensure_future(run_unit(unit))
+        in_flight.append((unit, task))
+        # Enough requests queued to keep every slot busy, without building
+        # the prompts of the whole dataset up front
+        if len(in_flight) >= 2 * concurrency:
+            await finish_oldest()
+            completed += 1
+    while in_flight:
+        await finish_oldest()
+        completed += 1
+    return completed
+
+def run_scheduled_inference(units, model, on_result, concurrency=4, max_tokens=750, host=None, ordered=True,
+                            keep_alive=None, json_mode=None, num_ctx=None, model_concurrency=None):
+    """
+    Sends the prompts of ``units`` (iterable of dicts with a "prompt" key,
+    consumed lazily) to ``model`` with up to ``concurrency`` requests in
+    flight, or the limit ``model_concurrency`` gives for ``model`` (see
+    model_concurrency_of). ``on_result(unit, analysis_result, runtime, timings)`` is called
+    for every unit in input order, or as soon as each result arrives with
+    ``ordered=False``. ``runtime`` covers only the request itself, from the
+    moment a concurrency slot is acquired; ``timings`` is the server-side
+    breakdown from inference_timings. ``keep_alive`` is passed with every
+    request (see ModelSession). ``json_mode`` is one of JSON_MODES; with
+    "early_stop" or "structured" the timings also hold early_stop and
+    tokens_saved (see local_llm_infer_v2_json). ``num_ctx`` is sent with
+    every request; keep it fixed for a model (and equal to the ModelSession's),
+    since a different num_ctx makes the server reload the model. Returns the
+    number of units run.
+    """
+    if json_mode not in JSON_MODES:
+        raise ValueError(f"Unknown json_mode {json_mode!r}, expected one of {JSON_MODES}")
+    concurrency = model_concurrency_of(model, concurrency, model_concurrency)
+    if concurrency < 1:
+        raise ValueError(f"Concurrency for {model} must be at least 1, got {concurrency}")
+    return asyncio.run(_schedule(units, model, on_result, concurrency, max_tokens, host, ordered, keep_alive,
+                                 json_mode, num_ctx))
@@ -2,35 +2,235 @@
 
 import ollama
 import uuid
+import time
 
+from extract_json_github_version import IncrementalJSONDetector, VERDICT_SCHEMA
 
-def local_llm_infer(prompt,  max_tokens = 30, model = "gemma3:1b"):
+
+# Sampling options shared by the local_llm_infer_v2 variants; num_ctx (see
+# budget_planner) is only sent when set, otherwise the server default applies
+def _v2_options(max_tokens, num_ctx=None):
+    options = {
+        "num_predict": max_tokens,
+        "temperature": 0.0,
+        "top_p": 1.0,
+        "seed": 2107
+    }
+    if num_ctx:
+        options["num_ctx"] = num_ctx
+    return options
+
+def local_llm_infer(prompt,  max_tokens = 30, model = "gemma3:1b", timings = False, keep_alive = None, num_ctx = None):
+    ctx_option = {"num_ctx": num_ctx} if num_ctx else {}
+    if timings:
+        # Streamed so that the first token can be timed
+        t1 = time.time()
+        chunks = ollama.chat(
+                model = model,
+                messages = prompt,
+                stream = True,
+                keep_alive = keep_alive,
+                options={
+                    "num_predict": max_tokens,
+                    "temperature": 0.0,
+                    "think": False,
+                    **ctx_option
+        })
+        return _collect_stream(chunks, t1, lambda chunk: chunk['message']['content'])
     result = ollama.chat(
             model = model,
             messages = prompt,
+            keep_alive = keep_alive,
             options={
                 "stream": False,
                 "num_predict": max_tokens,
                 "temperature": 0.0,
-                "think": False
+                "think": False,
+                **ctx_option
     })
     return result['message']['content'].strip()
 
-def local_llm_infer_v2(prompt_text, max_tokens=500, model="gemma3:1b"):
+def local_llm_infer_v2(prompt_text, max_tokens=500, model="gemma3:1b", timings=False, keep_alive=None, num_ctx=None):
     
+    if timings:
+        # Streamed so that the first token can be timed
+        t1 = time.time()
+        chunks = ollama.generate(
+            model=model,
+            prompt=prompt_text,
+            stream=True,
+            keep_alive=keep_alive,
+            options=_v2_options(max_tokens, num_ctx)
+        )
+        return _collect_stream(chunks, t1, lambda chunk: chunk["response"])
     result = ollama.generate(
         model=model,
         prompt=prompt_text,
-        options={
-            "num_predict": max_tokens,
-            "temperature": 0.0,
-            "top_p": 1.0,
-            "seed": 2107
-        }
+        keep_alive=keep_alive,
+        options=_v2_options(max_tokens, num_ctx)
+    )
+    return result["response"].strip()
+
+
+async def local_llm_infer_v2_async(prompt_text, max_tokens=500, model="gemma3:1b", client=None, timings=False,
+                                   keep_alive=None, num_ctx=None):
+    # Same request as local_llm_infer_v2 through ollama.AsyncClient
+    client = client or ollama.AsyncClient()
+    if timings:
+        t1 = time.time()
+        chunks = await client.generate(model=model, prompt=prompt_text, stream=True, keep_alive=keep_alive,
+                                       options=_v2_options(max_tokens, num_ctx))
+        return await _collect_stream_async(chunks, t1, lambda chunk: chunk["response"])
+    result = await client.generate(
+        model=model,
+        prompt=prompt_text,
+        keep_alive=keep_alive,
+        options=_v2_options(max_tokens, num_ctx)
     )
     return result["response"].strip()
 
 
+# ---- Timing records ----
+# With timings=True the wrappers stream the response and return
+# (text, timing record) instead of the text alone
+
+def inference_timings(final, t1, t_first, t2):
+    """
+    Timing record of one request, from the final (done) response of Ollama
+    and the client-side clock. All durations are in seconds:
+    load_duration (model load, 0 when the model was already loaded),
+    prompt_eval_count/prompt_eval_duration, eval_count/eval_duration,
+    total_duration (server side), the derived tokens_per_second and
+    prompt_tokens_per_second, time_to_first_token (first non-empty streamed
+    chunk) and wall_time (t2 - t1 as measured by the caller).
+    """
+    ns = 1e9
+    record = {
+        "load_duration": (final.get("load_duration") or 0) / ns,
+        "prompt_eval_count": final.get("prompt_eval_count") or 0,
+        "prompt_eval_duration": (final.get("prompt_eval_duration") or 0) / ns,
+        "eval_count": final.get("eval_count") or 0,
+        "eval_duration": (final.get("eval_duration") or 0) / ns,
+        "total_duration": (final.get("total_duration") or 0) / ns,
+        "time_to_first_token": (t_first - t1) if t_first is not None else None,
+        "wall_time": t2 - t1,
+    }
+    record["tokens_per_second"] = record["eval_count"] / record["eval_duration"] if record["eval_duration"] else None
+    record["prompt_tokens_per_second"] = (record["prompt_eval_count"] / record["prompt_eval_duration"]
+                                          if record["prompt_eval_duration"] else None)
+    return record
+
+def _collect_stream(chunks, t1, text_of):
+    parts, t_first, final = [], None, {}
+    for chunk in chunks:
+        piece = text_of(chunk)
+        if piece and t_first is None:
+            t_first = time.time()
+        parts.append(piece or "")
+        final = chunk
+    t2 = time.time()
+    return "".join(parts).strip(), inference_timings(final, t1, t_first, t2)
 
+async def _collect_stream_async(chunks, t1, text_of):
+    parts, t_first, final = [], None, {}
+    async for chunk in chunks:
+        piece = text_of(chunk)
+        if piece and t_first is None:
+            t_first = time.time()
+        parts.append(piece or "")
+        final = chunk
+    t2 = time.time()
+    return "".join(parts).strip(), inference_timings(final, t1, t_first, t2)
 
 
+# ---- Verdict streaming ----
+# Generation stops as soon as the verdict JSON is complete instead of running
+# on to num_predict. Early stop closes the stream, which drops the connection;
+# Ollama cancels the request when its client goes away.
+
+# Server-side fields that only the final (done) chunk carries
+_SERVER_TIMINGS = ("load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_duration", "total_duration",
+                   "tokens_per_second", "prompt_tokens_per_second")
+
+class _VerdictStream:
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self.detector = IncrementalJSONDetector()
+        self.t1 = time.time()
+        self.t_first = None
+        self.streamed = 0
+        self.final = {}
+        self.early_stop = False
+
+    def feed(self, chunk):
+        """Takes one streamed chunk; True once the verdict is complete."""
+        piece = chunk["response"]
+        if chunk.get("done"):
+            self.final = chunk
+        if not piece:
+            return False
+        if self.t_first is None:
+            self.t_first = time.time()
+        # Ollama streams one token per chunk
+        self.streamed += 1
+        if self.detector.feed(piece):
+            self.early_stop = not chunk.get("done")
+            return True
+        return False
+
+    def result(self):
+        t2 = time.time()
+        record = inference_timings(self.final, self.t1, self.t_first, t2)
+        if self.early_stop:
+            for key in _SERVER_TIMINGS:
+                record[key] = None
+            record["eval_count"] = self.streamed
+        text = self.detector.text[:self.detector.end] if self.detector.end else self.detector.text
+        record["early_stop"] = self.early_stop
+        # Upper bound, measured against the num_predict budget: the most a run
+        # to the token limit would have generated on top of what was streamed.
+        # A generation that ended on its own saved nothing.
+        record["tokens_saved"] = max(self.max_tokens - record["eval_count"], 0) if self.early_stop else 0
+        return text.strip(), record
+
+def local_llm_infer_v2_json(prompt_text, max_tokens=750, model="gemma3:1b", structured=False, keep_alive=None,
+                            num_ctx=None):
+    """
+    Same request as local_llm_infer_v2, streamed and stopped once a complete
+    JSON object with phishing_score, is_phishing and reasoning has been
+    generated. ``structured=True`` also passes VERDICT_SCHEMA as ``format``,
+    so the server constrains the output to the verdict object. Returns
+    (text, record): the inference_timings record (server-side fields are None
+    after an early stop, which cuts off the final chunk), plus early_stop and
+    tokens_saved: after an early stop, num_predict minus the tokens generated
+    (an upper bound, as the model might have stopped sooner on its own);
+    otherwise 0.
+    """
+    stream = _VerdictStream(max_tokens)
+    chunks = ollama.generate(
+        model=model,
+        prompt=prompt_text,
+        stream=True,
+        format=VERDICT_SCHEMA if structured else None,
+        keep_alive=keep_alive,
+        options=_v2_options(max_tokens, num_ctx)
+    )
+    for chunk in chunks:
+        if stream.feed(chunk):
+            chunks.close()
+            break
+    return stream.result()
+
+async def local_llm_infer_v2_json_async(prompt_text, max_tokens=750, model="gemma3:1b", client=None,
+                                        structured=False, keep_alive=None, num_ctx=None):
+    # Same request as local_llm_infer_v2_json through ollama.AsyncClient
+    client = client or ollama.AsyncClient()
+    stream = _VerdictStream(max_tokens)
+    chunks = await client.generate(model=model, prompt=prompt_text, stream=True,
+                                   format=VERDICT_SCHEMA if structured else None, keep_alive=keep_alive,
+                                   options=_v2_options(max_tokens, num_ctx))
+    async for chunk in chunks:
+        if stream.feed(chunk):
+            await chunks.aclose()
+            break
+    return stream.result()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+import pandas as pd
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from results_store_github_version import *
+
+# -------------------------
+# Metrics over a results store
+# -------------------------
+# All metrics are computed per group (default: model and truncation level)
+# with column operations and one groupby, on frames in RESULT_SCHEMA.
+# Phishing is the positive class. A run without a parsed is_phishing counts
+# as a parse failure: it is wrong for accuracy and a missed phish for recall,
+# and never a false positive.
+
+DEFAULT_GROUPS = ["model", "truncation_level"]
+LATENCY_COLUMNS = ["runtime", "time_to_first_token", "total_duration"]
+PERCENTILES = [0.5, 0.95, 0.99]
+
+def classification_metrics(frame, by=None) -> pd.DataFrame:
+    by = by or DEFAULT_GROUPS
+    pred = frame["is_phishing"]
+    label = frame["label"].fillna(False).astype(bool)
+    parsed = pred.notna()
+    said_phish = (pred == True).fillna(False).astype(bool)
+    said_benign = (pred == False).fillna(False).astype(bool)
+    counts = pd.DataFrame({
+        "runs": 1,
+        "tp": said_phish & label,
+        "fp": said_phish & ~label,
+        "tn": said_benign & ~label,
+        "fn": ~said_phish & label,
+        "parse_failures": ~parsed,
+    }, index=frame.index).astype(int)
+    counts[by] = frame[by]
+    sums = counts.groupby(by, dropna=False).sum()
+
+    metrics = pd.DataFrame(index=sums.index)
+    metrics["runs"] = sums["runs"]
+    metrics["accuracy"] = (sums["tp"] + sums["tn"]) / sums["runs"]
+    metrics["precision"] = sums["tp"] / (sums["tp"] + sums["fp"]).where(lambda d: d > 0)
+    metrics["recall"] = sums["tp"] / (sums["tp"] + sums["fn"]).where(lambda d: d > 0)
+    metrics["f1"] = (2 * metrics["precision"] * metrics["recall"]
+                     / (metrics["precision"] + metrics["recall"]).where(lambda d: d > 0))
+    metrics["parse_failure_rate"] = sums["parse_failures"] / sums["runs"]
+    return metrics
+
+def latency_percentiles(frame, by=None, columns=None, percentiles=None) -> pd.DataFrame:
+    """``column``_p50/_p95/_p99 (by default) per group, in seconds."""
+    by = by or DEFAULT_GROUPS
+    columns = [c for c in (columns or LATENCY_COLUMNS) if c in frame.columns]
+    percentiles = percentiles or PERCENTILES
+    quantiles = frame[by + columns].astype({c: float for c in columns}).groupby(by, dropna=False)[columns]
+    quantiles = quantiles.quantile(percentiles).unstack()
+    quantiles.columns = [f"{c}_p{round(q * 100)}" for c, q in quantiles.columns]
+    return quantiles
+
+def metrics_report(frame, by=None) -> pd.DataFrame:
+    """classification_metrics and latency_percentiles side by side."""
+    return classification_metrics(frame, by).join(latency_percentiles(frame, by))
+
+
+if __name__ == "__main__":
+    # Usage: metrics_github_version.py RESULTS (results store, or a results log ending in .jsonl)
+    path = sys.argv[1]
+    frame = results_from_log(path) if path.endswith(".jsonl") else load_results(path)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(metrics_report(frame))
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+import json
+import time
+import queue
+import random
+import hashlib
+import threading
+from os.path import commonprefix
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------------
+# Mock Ollama server
+# -------------------------
+# Stand-in for an Ollama server, for load-testing the harness (scheduler,
+# result log, resume, early stop) on a machine without a GPU. It speaks
+# /api/generate, /api/chat (streamed as NDJSON or not), /api/tags, /api/show
+# and /api/ps, with the same load/unload semantics as Ollama: an empty
+# prompt loads a model, keep_alive=0 unloads it, and a request for another
+# model or another num_ctx reloads. Requests hold one of ``parallel`` slots
+# and queue for a free one, like OLLAMA_NUM_PARALLEL. Each slot remembers its
+# last prompt, and the shared prefix is not evaluated again, as with the KV
+# cache reuse of llama.cpp. Tokens are approximated as 4 characters.
+#
+# Durations are given in seconds, either as a number or as a distribution:
+# ("uniform", low, high), ("lognormal", mu, sigma) or ("exponential", mean).
+#
+#   with MockOllamaServer(parallel=4, token_rate=200) as server:
+#       run_scheduled_inference(units, "mock:1b", on_result, host=server.url)
+
+DEFAULT_MODELS = {
+    "mock:1b": {"size": 1 * 1024 ** 3, "context_length": 32768},
+    "mock:4b": {"size": 4 * 1024 ** 3, "context_length": 131072},
+    "mock:12b": {"size": 12 * 1024 ** 3, "context_length": 131072},
+}
+
+DEFAULT_RESPONSES = [
+    '{"phishing_score": 8, "is_phishing": true, "reasoning": "Login form posts to a domain that does not match the brand."}',
+    '```json\n{"phishing_score": 1, "is_phishing": false, "reasoning": "Consistent domain, contact and privacy links."}\n```',
+    '{"phishing_score": 5, "is_phishing": false, "reasoning": "Some urgent wording, but no credential form."}',
+    "I cannot determine whether this website is a phishing site from the given HTML.",
+]
+
+DEFAULT_NUM_CTX = 4096
+
+_PIECE_RE = re.compile(r"\s*\S+|\s+")
+
+def _sample(spec, rng) -> float:
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    kind, a, *b = spec
+    if kind == "uniform":
+        return rng.uniform(a, b[0])
+    if kind == "lognormal":
+        return rng.lognormvariate(a, b[0])
+    if kind == "exponential":
+        return rng.expovariate(1.0 / a)
+    raise ValueError(f"Unknown distribution {kind!r}")
+
+def _tokens(text) -> int:
+    return (len(text) + 3) // 4
+
+
+class MockOllamaServer:
+    """
+    Mock server on ``host``:``port`` (port 0 picks a free one; see ``url``).
+    ``latency``: time before the first token on top of prompt evaluation;
+    ``token_rate``: generated tokens per second (one streamed chunk each);
+    ``prompt_rate``: prompt tokens evaluated per second; ``load_delay``:
+    model load time; ``parallel``: request slots. The answer to a prompt is
+    picked from ``responses`` by a hash of the prompt, so repeated requests
+    get the same answer like temperature 0; with ``format`` set only the
+    responses that are JSON objects are used. ``stats`` counts requests,
+    loads, cancelled streams and the peak number of requests in a slot.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, models=None, latency=0.0, token_rate=100.0, prompt_rate=5000.0,
+                 load_delay=0.0, parallel=4, responses=None, seed=0):
+        self.models = models or DEFAULT_MODELS
+        self.latency = latency
+        self.token_rate = token_rate
+        self.prompt_rate = prompt_rate
+        self.load_delay = load_delay
+        self.responses = responses or DEFAULT_RESPONSES
+        self.rng = random.Random(seed)
+        self.slots = queue.Queue()
+        for slot in range(parallel):
+            self.slots.put(slot)
+        self.slot_prompts = {}
+        self.loaded = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "loads": 0, "unloads": 0, "cancelled": 0, "active": 0, "peak_active": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    # -------------------------
+    # Model state
+    # -------------------------
+    def _draw(self, spec) -> float:
+        with self.lock:
+            return _sample(spec, self.rng)
+
+    def _ensure_loaded(self, model, num_ctx) -> float:
+        """Loads ``model`` with ``num_ctx`` unless it already is; returns the
+        load time in seconds."""
+        with self.lock:
+            if self.loaded.get(model) == num_ctx:
+                return 0.0
+            # Like Ollama with the default OLLAMA_MAX_LOADED_MODELS on a full
+            # GPU: one model at a time
+            self.loaded = {model: num_ctx}
+            self.slot_prompts.clear()
+            self.stats["loads"] += 1
+        delay = self._draw(self.load_delay)
+        time.sleep(delay)
+        return delay
+
+    def _unload(self, model) -> None:
+        with self.lock:
+            if self.loaded.pop(model, None) is not None:
+                self.stats["unloads"] += 1
+                self.slot_prompts.clear()
+
+    def _answer(self, prompt, structured) -> str:
+        candidates = [r for r in self.responses if r.lstrip().startswith("{")] if structured else self.responses
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        return (candidates or self.responses)[int.from_bytes(digest[:4], "big") % len(candidates or self.responses)]
+
+    # -------------------------
+    # Completion
+    # -------------------------
+    def complete(self, body, write, piece_of):
+        """Runs one completion request, passing every response object to
+        ``write``; ``piece_of(text, done)`` shapes the API-specific fields."""
+        model = body["model"]
+        options = body.get("options") or {}
+        num_ctx = options.get("num_ctx") or DEFAULT_NUM_CTX
+        prompt = body.get("prompt")
+        if prompt is None:
+            prompt = "".join(m.get("content", "") for m in body.get("messages") or [])
+        stream = body.get("stream", True)
+        t_start = time.time()
+
+        slot = self.slots.get()
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["active"] += 1
+            self.stats["peak_active"] = max(self.stats["peak_active"], self.stats["active"])
+        try:
+            load = self._ensure_loaded(model, num_ctx)
+            with self.lock:
+                cached = len(commonprefix([self.slot_prompts.get(slot, ""), prompt]))
+                self.slot_prompts[slot] = prompt
+            # The context window holds the prompt; longer prompts are cut like
+            # Ollama does, silently
+            prompt_eval_count = min(_tokens(prompt[cached:]), num_ctx)
+            prompt_eval = prompt_eval_count / self.prompt_rate + self._draw(self.latency)
+            time.sleep(prompt_eval)
+
+            pieces = _PIECE_RE.findall(self._answer(prompt, bool(body.get("format"))))
+            num_predict = options.get("num_predict")
+            done_reason = "stop"
+            if num_predict is not None and 0 <= num_predict < len(pieces):
+                pieces, done_reason = pieces[:num_predict], "length"
+
+            t_eval = time.time()
+            text = []
+            for piece in pieces:
+                time.sleep(1.0 / self.token_rate)
+                text.append(piece)
+                if stream:
+                    write({"model": model, "created_at": _now(), "done": False, **piece_of(piece, False)})
+            eval_duration = time.time() - t_eval
+            final = {
+                "model": model,
+                "created_at": _now(),
+                "done": True,
+                "done_reason": done_reason,
+                "total_duration": int((time.time() - t_start) * 1e9),
+                "load_duration": int(load * 1e9),
+                "prompt_eval_count": prompt_eval_count,
+                "prompt_eval_duration": int(prompt_eval * 1e9),
+                "eval_count": len(pieces),
+                "eval_duration": int(eval_duration * 1e9),
+                **piece_of("" if stream else "".join(text), True),
+            }
+            write(final)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client closed the stream (e.g. early stop)
+            with self.lock:
+                self.stats["cancelled"] += 1
+        finally:
+            with self.lock:
+                self.stats["active"] -= 1
+            self.slots.put(slot)
+
+    # -------------------------
+    # HTTP
+    # -------------------------
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _stream(self, body, piece_of):
+                if body.get("stream", True):
+                    # NDJSON, one object per line; without a Content-Length
+                    # the response ends when the connection closes
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+
+                    def write(obj):
+                        self.wfile.write(json.dumps(obj).encode("utf-8") + b"\n")
+                        self.wfile.flush()
+                    server.complete(body, write, piece_of)
+                    self.close_connection = True
+                else:
+                    results = []
+                    server.complete(body, results.append, piece_of)
+                    self._send_json(200, results[-1])
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json(200, {"models": [
+                        {"name": name, "model": name, "size": info["size"],
+                         "digest": hashlib.sha256(name.encode()).hexdigest(), "modified_at": "2025-01-01T00:00:00Z",
+                         "details": {"format": "gguf", "family": "mock"}}
+                        for name, info in server.models.items()
+                    ]})
+                elif self.path == "/api/ps":
+                    with server.lock:
+                        loaded = list(server.loaded)
+                    self._send_json(200, {"models": [
+                        {"name": name, "model": name, "size": server.models[name]["size"],
+                         "size_vram": server.models[name]["size"]} for name in loaded
+                    ]})
+                elif self.path in ("/", "/api/version"):
+                    self._send_json(200, {"version": "0.0.0-mock"})
+                else:
+                    self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.end_headers()
+
+            def do_POST(self):
+                body = self._read_body()
+                model = body.get("model") or body.get("name")
+                if self.path not in ("/api/generate", "/api/chat", "/api/show"):
+                    self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+                    return
+                if model not in server.models:
+                    self._send_json(404, {"error": f"model '{model}' not found"})
+                    return
+                if self.path == "/api/show":
+                    self._send_json(200, {
+                        "modelfile": "", "parameters": "", "template": "{{ .Prompt }}",
+                        "details": {"format": "gguf", "family": "mock"},
+                        "model_info": {"general.architecture": "mock",
+                                       "mock.context_length": server.models[model]["context_length"]},
+                    })
+                    return
+
+                chat = self.path == "/api/chat"
+                empty = not (body.get("messages") if chat else body.get("prompt"))
+                if empty:
+                    # Load (or with keep_alive=0 unload) request
+                    load = 0.0
+                    if body.get("keep_alive") in (0, "0", "0s"):
+                        server._unload(model)
+                        reason = "unload"
+                    else:
+                        num_ctx = (body.get("options") or {}).get("num_ctx") or DEFAULT_NUM_CTX
+                        load = server._ensure_loaded(model, num_ctx)
+                        reason = "load"
+                    payload = {"model": model, "created_at": _now(), "done": True, "done_reason": reason}
+                    if reason == "load":
+                        payload["load_duration"] = int(load * 1e9)
+                    payload.update({"message": {"role": "assistant", "content": ""}} if chat else {"response": ""})
+                    self._send_json(200, payload)
+                    return
+                if chat:
+                    self._stream(body, lambda text, done: {"message": {"role": "assistant", "content": text}})
+                else:
+                    self._stream(body, lambda text, done: {"response": text})
+
+        return Handler
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+if __name__ == "__main__":
+    # Usage: mock_ollama_server_github_version.py [PORT] [PARALLEL] [TOKEN_RATE]
+    # then point the harness at it with OLLAMA_HOST=http://127.0.0.1:PORT
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 11435
+    parallel = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    token_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 100.0
+    server = MockOllamaServer(port=port, parallel=parallel, token_rate=token_rate,
+                              latency=("lognormal", -3.0, 0.5), load_delay=1.0)
+    print(f"mock Ollama server on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
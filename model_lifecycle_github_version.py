@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import ollama
+
+# -------------------------
+# Model ordering
+# -------------------------
+def order_models_by_size(model_list, host=None) -> list:
+    """``model_list`` sorted by model size on disk, smallest first, so every
+    switch loads the next-larger model into memory the previous one freed.
+    Models unknown to the server keep their relative order at the end."""
+    sizes = {m["model"]: m["size"] for m in ollama.Client(host=host).list()["models"]}
+    return sorted(model_list, key=lambda m: (m not in sizes, sizes.get(m, 0)))
+
+# -------------------------
+# Model lifecycle
+# -------------------------
+class ModelSession:
+    """
+    Context manager around the block of a sweep that uses one model.
+
+    On enter, any other loaded model is unloaded (optional), the model is
+    loaded with an empty prompt and pinned with ``keep_alive``, and a short
+    warm-up request is run, so the first timed request neither loads the
+    model nor pays for first-request initialization. Requests made inside the
+    block should pass ``session.keep_alive`` so the server does not evict
+    the model. On exit the model is unloaded explicitly (keep_alive=0).
+
+    ``load_report`` holds the load and warm-up costs, reported apart from
+    the per-page timings: load_wall_time and load_duration (server side) of
+    the preload, warmup_wall_time, and unload_wall_time after exit.
+
+    ``num_ctx`` must match the num_ctx of the requests in the block: the
+    server loads the model with it, and a request with another num_ctx would
+    reload the model.
+    """
+
+    def __init__(self, model, keep_alive=-1, warmup_prompt="Reply with OK.", unload_others=True, host=None,
+                 num_ctx=None):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.ctx_option = {"num_ctx": num_ctx} if num_ctx else {}
+        self.warmup_prompt = warmup_prompt
+        self.unload_others = unload_others
+        self.client = ollama.Client(host=host)
+        self.load_report = {"model": model}
+
+    def __enter__(self):
+        if self.unload_others:
+            for loaded in self.client.ps()["models"]:
+                if loaded["model"] != self.model:
+                    self.client.generate(model=loaded["model"], keep_alive=0)
+
+        t1 = time.time()
+        result = self.client.generate(model=self.model, keep_alive=self.keep_alive, options=self.ctx_option)
+        t2 = time.time()
+        self.load_report["load_wall_time"] = t2 - t1
+        self.load_report["load_duration"] = (result.get("load_duration") or 0) / 1e9
+
+        if self.warmup_prompt:
+            t1 = time.time()
+            self.client.generate(model=self.model, prompt=self.warmup_prompt, keep_alive=self.keep_alive,
+                                 options={"num_predict": 8, "temperature": 0.0, **self.ctx_option})
+            t2 = time.time()
+            self.load_report["warmup_wall_time"] = t2 - t1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.time()
+        self.client.generate(model=self.model, keep_alive=0)
+        self.load_report["unload_wall_time"] = time.time() - t1
+        return False
+
+# -------------------------
+# Async preload and unload
+# -------------------------
+# The preload, warm-up and unload of ModelSession on an ollama.AsyncClient,
+# for callers that switch models on a host themselves (endpoint_pool)
+
+async def preload_model_async(client, model, keep_alive=-1, num_ctx=None, warmup_prompt="Reply with OK.") -> dict:
+    """Loads, pins and warms up ``model``; returns a ModelSession load_report
+    (unload_wall_time is added by the caller after unload_model_async)."""
+    ctx_option = {"num_ctx": num_ctx} if num_ctx else {}
+    load_report = {"model": model}
+    t1 = time.time()
+    result = await client.generate(model=model, keep_alive=keep_alive, options=ctx_option)
+    t2 = time.time()
+    load_report["load_wall_time"] = t2 - t1
+    load_report["load_duration"] = (result.get("load_duration") or 0) / 1e9
+    if warmup_prompt:
+        t1 = time.time()
+        await client.generate(model=model, prompt=warmup_prompt, keep_alive=keep_alive,
+                              options={"num_predict": 8, "temperature": 0.0, **ctx_option})
+        load_report["warmup_wall_time"] = time.time() - t1
+    return load_report
+
+async def unload_model_async(client, model) -> float:
+    """Unloads ``model`` (keep_alive=0); returns the wall time it took."""
+    t1 = time.time()
+    await client.generate(model=model, keep_alive=0)
+    return time.time() - t1
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+
+# On-disk cache for the preprocessing stage, keyed by content so that the
+# same page is never tokenized or truncated twice across runs:
+#   token_counts: (content_hash, tokenizer) -> token count
+#   truncations:  (content_hash, tokenizer, budget, pipeline) -> truncated html
+# ``pipeline`` is PIPELINE_VERSION plus the parser backend, so a change to the
+# truncation code or parser never serves stale output. Truncations are evicted
+# least recently used first once they exceed ``max_bytes``.
+
+class PreprocessingCache:
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 ** 3):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        # Running total of the stored truncation sizes, read once on the
+        # first insert so that inserts do not scan the table
+        self.stored_bytes = None
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts ("
+            "content_hash TEXT, tokenizer TEXT, token_count INTEGER, "
+            "PRIMARY KEY (content_hash, tokenizer))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS truncations ("
+            "content_hash TEXT, tokenizer TEXT, budget REAL, pipeline TEXT, "
+            "html TEXT, size INTEGER, last_used REAL, "
+            "PRIMARY KEY (content_hash, tokenizer, budget, pipeline))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS truncations_lru ON truncations (last_used)")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # -------------------------
+    # Token counts
+    # -------------------------
+    def get_token_count(self, content_hash: str, tokenizer: str):
+        row = self.conn.execute(
+            "SELECT token_count FROM token_counts WHERE content_hash = ? AND tokenizer = ?",
+            (content_hash, tokenizer),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_token_count(self, content_hash: str, tokenizer: str, token_count: int) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO token_counts VALUES (?, ?, ?)",
+            (content_hash, tokenizer, token_count),
+        )
+        self.conn.commit()
+
+    # -------------------------
+    # Truncations
+    # -------------------------
+    def get_truncation(self, content_hash: str, tokenizer: str, budget: float, pipeline: str):
+        key = (content_hash, tokenizer, budget, pipeline)
+        row = self.conn.execute(
+            "SELECT html FROM truncations WHERE content_hash = ? AND tokenizer = ? AND budget = ? AND pipeline = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            "UPDATE truncations SET last_used = ? WHERE content_hash = ? AND tokenizer = ? AND budget = ? AND pipeline = ?",
+            (time.time(),) + key,
+        )
+        self.conn.commit()
+        return row[0]
+
+    def put_truncation(self, content_hash: str, tokenizer: str, budget: float, pipeline: str, html: str) -> None:
+        key = (content_hash, tokenizer, budget, pipeline)
+        size = len(html.encode("utf-8"))
+        if self.stored_bytes is None:
+            self.stored_bytes = self._total_bytes()
+        replaced = self.conn.execute(
+            "SELECT size FROM truncations WHERE content_hash = ? AND tokenizer = ? AND budget = ? AND pipeline = ?",
+            key,
+        ).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO truncations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            key + (html, size, time.time()),
+        )
+        self.conn.commit()
+        self.stored_bytes += size - (replaced[0] if replaced else 0)
+        if self.stored_bytes > self.max_bytes:
+            self.evict()
+
+    def _total_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM truncations").fetchone()[0]
+
+    def evict(self) -> None:
+        """Drops least recently used truncations until the stored html is
+        at most max_bytes (down to 90% of it, so eviction is not run on
+        every insert). put_truncation calls it only when the running total
+        goes over max_bytes; the total is recounted here, as other processes
+        may share the cache file."""
+        total = self._total_bytes()
+        self.stored_bytes = total
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT rowid, size FROM truncations ORDER BY last_used").fetchall()
+        doomed = []
+        for rowid, size in rows:
+            if total <= target:
+                break
+            doomed.append((rowid,))
+            total -= size
+        self.conn.executemany("DELETE FROM truncations WHERE rowid = ?", doomed)
+        self.conn.commit()
+        self.stored_bytes = total
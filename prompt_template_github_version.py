@@ -1,61 +1,129 @@
 # -*- coding: utf-8 -*-
 
-def build_html_prompt_v4(html_text, original_character_count):
-    prompt = (
-        "You are a cybersecurity expert analyzing websites for phishing attempts. Your task is to examine the provided HTML code and determine if the website is likely a phishing site.\n\n"
+# ---- Shared instruction sections ----
+# v4 and v5 differ only in the opening sentence and in where the page goes,
+# so both are built from these sections
+
+_ROLE = ("You are a cybersecurity expert analyzing websites for phishing attempts. Your task is to examine the "
+         "{html_location} and determine if the website is likely a phishing site.\n\n")
+
+_TRUNCATION_NOTE = "**Important:** The HTML may be truncated to reduce costs, so CSS styles and JavaScript code may be missing. Focus on HTML structure, text content, and URLs.\n\n"
+
+_INDICATORS = (
+    "**Look for these phishing indicators (focus on HTML structure and content):**\n\n"
+
+    "1. **Suspicious URLs/domains** - Check href attributes, form actions, image sources for:\n"
+       "- Misspelled brand names, unusual domains, suspicious subdomains\n"
+       "- IP addresses instead of domains, excessive hyphens, unusual TLDs\n"
+    "2. **Form analysis** - Login/input forms with:\n"
+       "- Action URLs pointing to wrong domains\n"
+       "- Password/sensitive data collection for mismatched brands\n"
+       "- Excessive personal information requests (SSN, full address, etc.)\n"
+    "3. **Content and language** - Text containing:\n"
+       "- Urgent threats: 'Account suspended', 'Verify immediately', 'Limited time'\n"
+       "- Fear tactics: 'Security breach', 'Unauthorized access detected'\n"
+       "- Reward baits: 'You have won', 'Free gift', 'Exclusive offer'\n"
+    "4. **HTML structure issues**:\n"
+       "- Spelling/grammar errors in text content\n"
+       "- Inconsistent or poor HTML structure\n"
+       "- Missing or suspicious meta tags (title, description)\n"
+    "5. **Link analysis** - Check all href attributes for:\n"
+       "- Links to different domains than expected\n"
+       "- Shortened URLs (bit.ly, tinyurl, etc.)\n"
+       "- Misleading anchor text vs actual URL\n"
+    "6. **Brand impersonation** - Look for:\n"
+       "- Company names in text that don't match domain\n"
+       "- References to legitimate services (PayPal, Amazon, banks, ...) on wrong domains\n"
+       "- Official-sounding but incorrect terminology\n"
+    "7. **Missing legitimacy markers**:\n"
+       "- No contact information or privacy policy links\n"
+       "- Missing proper company details in footer\n"
+       "- No legitimate copyright notices\n\n"
+)
 
-        "**Important:** The HTML may be truncated to reduce costs, so CSS styles and JavaScript code may be missing. Focus on HTML structure, text content, and URLs.\n\n"
+_SCORING_AND_OUTPUT = (
+    "**Note:** Since CSS/JS may be truncated, focus on HTML tags, text content, and URL analysis rather than visual styling or dynamic behavior.\n"
+    "**Scoring guide:**\n"
+    "- 0-2: Very unlikely phishing (legitimate site)\n"
+    "- 3-4: Low risk (minor suspicious elements)\n"
+    "- 5-6: Medium risk (several concerning indicators)\n"
+    "- 7-8: High risk (multiple clear phishing signs)\n"
+    "- 9-10: Very high risk (obvious phishing attempt)\n\n"
+
+    "**Required output format (JSON only):**\n"
+    "{\n"
+      '"phishing_score": int [0-10],\n'
+      '"is_phishing": boolean [true/false],\n'
+      '"reasoning": string [Brief explanation of your decision based on specific indicators found]\n'
+    "}\n\n"
+
+    "**Output Constraints:**\n"
+    "Do only output the JSON formated output and nothing else.\n"
+)
+
+def _html_page(html_text, original_character_count):
+    return (
         f"HTML:'{html_text}'\n"
         f"Original HTML character count: {original_character_count}\n"
-        "**Look for these phishing indicators (focus on HTML structure and content):**\n\n"
-
-        "1. **Suspicious URLs/domains** - Check href attributes, form actions, image sources for:\n"
-           "- Misspelled brand names, unusual domains, suspicious subdomains\n"
-           "- IP addresses instead of domains, excessive hyphens, unusual TLDs\n"
-        "2. **Form analysis** - Login/input forms with:\n"
-           "- Action URLs pointing to wrong domains\n"
-           "- Password/sensitive data collection for mismatched brands\n"
-           "- Excessive personal information requests (SSN, full address, etc.)\n"
-        "3. **Content and language** - Text containing:\n"
-           "- Urgent threats: 'Account suspended', 'Verify immediately', 'Limited time'\n"
-           "- Fear tactics: 'Security breach', 'Unauthorized access detected'\n"
-           "- Reward baits: 'You have won', 'Free gift', 'Exclusive offer'\n"
-        "4. **HTML structure issues**:\n"
-           "- Spelling/grammar errors in text content\n"
-           "- Inconsistent or poor HTML structure\n"
-           "- Missing or suspicious meta tags (title, description)\n"
-        "5. **Link analysis** - Check all href attributes for:\n"
-           "- Links to different domains than expected\n"
-           "- Shortened URLs (bit.ly, tinyurl, etc.)\n"
-           "- Misleading anchor text vs actual URL\n"
-        "6. **Brand impersonation** - Look for:\n"
-           "- Company names in text that don't match domain\n"
-           "- References to legitimate services (PayPal, Amazon, banks, ...) on wrong domains\n"
-           "- Official-sounding but incorrect terminology\n"
-        "7. **Missing legitimacy markers**:\n"
-           "- No contact information or privacy policy links\n"
-           "- Missing proper company details in footer\n"
-           "- No legitimate copyright notices\n\n"
-        
-        "**Note:** Since CSS/JS may be truncated, focus on HTML tags, text content, and URL analysis rather than visual styling or dynamic behavior.\n"
-        "**Scoring guide:**\n"
-        "- 0-2: Very unlikely phishing (legitimate site)\n"
-        "- 3-4: Low risk (minor suspicious elements)\n"
-        "- 5-6: Medium risk (several concerning indicators)\n"
-        "- 7-8: High risk (multiple clear phishing signs)\n"
-        "- 9-10: Very high risk (obvious phishing attempt)\n\n"
-        
-        "**Required output format (JSON only):**\n"
-        "{\n"
-          '"phishing_score": int [0-10],\n'
-          '"is_phishing": boolean [true/false],\n'
-          '"reasoning": string [Brief explanation of your decision based on specific indicators found]\n'
-        "}\n\n"
-        
-        "**Output Constraints:**\n"
-        "Do only output the JSON formated output and nothing else.\n"
-        
-        
+    )
+
+def build_html_prompt_v4(html_text, original_character_count):
+    prompt = (
+        _ROLE.format(html_location="provided HTML code")
+        + _TRUNCATION_NOTE
+        + _html_page(html_text, original_character_count)
+        + _INDICATORS
+        + _SCORING_AND_OUTPUT
     )
 
     return prompt
+
+
+# ---- v5: static prefix first ----
+# Same instructions as v4, but everything that does not depend on the page
+# comes first and the HTML last. Requests then share a byte-identical prefix,
+# which Ollama/llama.cpp keeps in the KV cache of the slot instead of
+# evaluating the instruction block again for every page.
+
+HTML_INSTRUCTIONS_V5 = (
+    _ROLE.format(html_location="HTML code provided at the end of this prompt")
+    + _TRUNCATION_NOTE
+    + _INDICATORS
+    + _SCORING_AND_OUTPUT
+)
+
+def build_html_prompt_v5(html_text, original_character_count):
+    return HTML_INSTRUCTIONS_V5 + "\n" + _html_page(html_text, original_character_count)
+
+def build_html_messages_v5(html_text, original_character_count):
+    # Chat API: the instructions as system message, the page as user message
+    return [
+        {"role": "system", "content": HTML_INSTRUCTIONS_V5},
+        {"role": "user", "content": _html_page(html_text, original_character_count)},
+    ]
+
+def build_html_messages_v4(html_text, original_character_count):
+    return [{"role": "user", "content": build_html_prompt_v4(html_text, original_character_count)}]
+
+
+# ---- Template registry ----
+# version -> {"generate": builder of the prompt string,
+#             "chat": builder of the message list}
+
+PROMPT_TEMPLATES = {
+    "v4": {"generate": build_html_prompt_v4, "chat": build_html_messages_v4},
+    "v5": {"generate": build_html_prompt_v5, "chat": build_html_messages_v5},
+}
+
+def available_prompt_templates() -> list:
+    return list(PROMPT_TEMPLATES)
+
+def build_prompt(html_text, original_character_count, version="v4", api="generate"):
+    """Prompt for ``html_text`` from template ``version``: a string for the
+    generate API (local_llm_infer_v2*), a message list for the chat API
+    (local_llm_infer)."""
+    if version not in PROMPT_TEMPLATES:
+        raise ValueError(f"Unknown prompt template {version!r}, expected one of {available_prompt_templates()}")
+    if api not in ("generate", "chat"):
+        raise ValueError(f"Unknown api {api!r}, expected 'generate' or 'chat'")
+    return PROMPT_TEMPLATES[version][api](html_text, original_character_count)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+# -------------------------
+# Append-only result log
+# -------------------------
+class ResultLog:
+    """
+    One JSON line per finished (model, dataset, pageID, run), appended and
+    fsynced as soon as the result is in, so a crash loses at most the
+    requests that were still running. A torn last line from a crash is cut
+    off when the log is opened.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = []
+        if os.path.exists(path):
+            valid_end = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        self.records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    valid_end += len(line)
+            if valid_end != os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        self.file.close()
+
+    def append(self, model: str, dataset: str, pageID: int, run: int, run_result: dict) -> None:
+        record = {"model": model, "dataset": dataset, "pageID": pageID, "run": run, **run_result}
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records.append(record)
+
+    def completed(self) -> set:
+        """(model, dataset, pageID, run) of every logged result."""
+        return {(r["model"], r["dataset"], r["pageID"], r["run"]) for r in self.records}
+
+    def consolidate(self, model: str) -> dict:
+        """Results of ``model`` as {model: {dataset: {pageID: {run: run_result}}}},
+        the layout of the res_{model}_all.json files, in page and run order."""
+        result_collection = {model: {}}
+        records = [r for r in self.records if r["model"] == model]
+        dataset_order = {}
+        for r in records:
+            dataset_order.setdefault(r["dataset"], len(dataset_order))
+        records.sort(key=lambda r: (dataset_order[r["dataset"]], r["pageID"], r["run"]))
+        for r in records:
+            run_result = {k: v for k, v in r.items() if k not in ("model", "dataset", "pageID", "run")}
+            result_collection[model].setdefault(r["dataset"], {}).setdefault(r["pageID"], {})[r["run"]] = run_result
+        return result_collection
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import json
+
+import pandas as pd
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from extract_json_github_version import extract_json_batch
+
+# -------------------------
+# Results schema
+# -------------------------
+# One row per (model, dataset, page, run), flattened from the result log or
+# the res_{model}_all.json files, with the verdict already parsed. Columns and
+# dtypes are fixed so that stores written by different sweeps concatenate.
+
+TIMING_COLUMNS = [
+    "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration", "total_duration",
+    "time_to_first_token", "wall_time", "tokens_per_second", "prompt_tokens_per_second",
+]
+
+RESULT_SCHEMA = {
+    "model": "string",
+    "dataset": "string",
+    "truncation_level": "Float64",
+    "page": "Int64",
+    "run": "Int64",
+    "ws_name": "string",
+    "label": "boolean",
+    "endpoint": "string",
+    "prompt_len": "Int64",
+    "page_tokens": "Int64",
+    "num_ctx": "Int64",
+    "runtime": "Float64",
+    **{c: ("Int64" if c.endswith("_count") else "Float64") for c in TIMING_COLUMNS},
+    "early_stop": "boolean",
+    "tokens_saved": "Int64",
+    "is_json": "boolean",
+    "needs_processing": "boolean",
+    "phishing_score": "Int64",
+    "is_phishing": "boolean",
+    "reasoning": "string",
+    "analysis_result": "string",
+}
+
+def truncation_level_of(dataset) -> float:
+    """Truncation level of a dataset named after its percentage, e.g.
+    "d5" -> 0.05; None when the name has no number."""
+    match = re.search(r"\d+", dataset)
+    return int(match.group()) / 100 if match else None
+
+def nested_to_records(result_collection) -> list:
+    """Flat result-log records from the {model: {dataset: {pageID: {run:
+    run_result}}}} layout of res_{model}_all.json."""
+    records = []
+    for model, datasets in result_collection.items():
+        for dataset, pages in datasets.items():
+            for pageID, runs in pages.items():
+                for run, run_result in runs.items():
+                    records.append({"model": model, "dataset": dataset, "pageID": int(pageID), "run": int(run),
+                                    **run_result})
+    return records
+
+def records_to_frame(records, truncation_levels=None) -> pd.DataFrame:
+    """
+    DataFrame in RESULT_SCHEMA from result-log records. ``truncation_levels``
+    maps dataset names to levels; other datasets go through
+    truncation_level_of. Verdicts are parsed with extract_json_batch.
+    """
+    records = list(records)
+    levels = truncation_levels or {}
+    timings = [r.get("timings") or {} for r in records]
+    columns = {
+        "model": [r["model"] for r in records],
+        "dataset": [r["dataset"] for r in records],
+        "truncation_level": [levels.get(r["dataset"], truncation_level_of(r["dataset"])) for r in records],
+        "page": [r["pageID"] for r in records],
+        "run": [r["run"] for r in records],
+        "ws_name": [r.get("ws_name") for r in records],
+        "label": [r.get("True_Phish_Label") for r in records],
+        "endpoint": [r.get("endpoint") for r in records],
+        "prompt_len": [r.get("prompt_len") for r in records],
+        "page_tokens": [r.get("page_tokens") for r in records],
+        "num_ctx": [r.get("num_ctx") for r in records],
+        "runtime": [r.get("runtime") for r in records],
+        **{c: [t.get(c) for t in timings] for c in TIMING_COLUMNS},
+        "early_stop": [t.get("early_stop") for t in timings],
+        "tokens_saved": [t.get("tokens_saved") for t in timings],
+        "analysis_result": [r.get("analysis_result") for r in records],
+    }
+    frame = pd.DataFrame({c: pd.Series(v, dtype=object) for c, v in columns.items()})
+    verdicts = extract_json_batch(frame["analysis_result"])
+    for c in ("is_json", "needs_processing", "phishing_score", "is_phishing", "reasoning"):
+        frame[c] = verdicts[c]
+    return frame[list(RESULT_SCHEMA)].astype(RESULT_SCHEMA)
+
+# -------------------------
+# Store files
+# -------------------------
+# The format follows the extension: .parquet and .feather need pyarrow (or
+# fastparquet for .parquet); .pkl works with pandas alone. Without an engine,
+# save_results writes a .pkl next to the requested path, so a sweep never
+# fails at its very last step.
+
+def _has_module(name) -> bool:
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+def columnar_engine_available(path) -> bool:
+    """Whether ``path`` can be written in its format with what is installed."""
+    if path.endswith(".parquet"):
+        return _has_module("pyarrow") or _has_module("fastparquet")
+    if path.endswith(".feather"):
+        return _has_module("pyarrow")
+    return True
+
+def save_results(frame, path) -> str:
+    """Writes the store and returns the path written (see above for the
+    fallback to .pkl)."""
+    if not columnar_engine_available(path):
+        fallback = os.path.splitext(path)[0] + ".pkl"
+        print(f"No Parquet/Feather engine (pip install pyarrow), writing {fallback} instead of {path}")
+        path = fallback
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".parquet"):
+        frame.to_parquet(path, index=False)
+    elif path.endswith(".feather"):
+        frame.reset_index(drop=True).to_feather(path)
+    elif path.endswith(".pkl"):
+        frame.to_pickle(path)
+    else:
+        raise ValueError(f"Unknown results store format: {path}")
+    return path
+
+def load_results(path, columns=None) -> pd.DataFrame:
+    """Results store at ``path``; ``columns`` reads only those (Parquet and
+    Feather read just those columns from disk). A store that save_results
+    wrote as .pkl for lack of an engine is found under the original path."""
+    fallback = os.path.splitext(path)[0] + ".pkl"
+    if not os.path.exists(path) and os.path.exists(fallback):
+        path = fallback
+    if path.endswith(".parquet"):
+        frame = pd.read_parquet(path, columns=columns)
+    elif path.endswith(".feather"):
+        frame = pd.read_feather(path, columns=columns)
+    elif path.endswith(".pkl"):
+        frame = pd.read_pickle(path)
+        frame = frame[columns] if columns else frame
+    else:
+        raise ValueError(f"Unknown results store format: {path}")
+    return frame.astype({c: t for c, t in RESULT_SCHEMA.items() if c in frame.columns})
+
+def results_from_log(log_path, truncation_levels=None) -> pd.DataFrame:
+    with open(log_path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.endswith("\n")]
+    return records_to_frame(records, truncation_levels)
+
+def results_from_files(paths, truncation_levels=None) -> pd.DataFrame:
+    """Results of res_{model}_all.json files."""
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            records.extend(nested_to_records(json.load(f)))
+    return records_to_frame(records, truncation_levels)
@@ -2,94 +2,80 @@
 
 import os
 import sys
-import tiktoken
 import pandas as pd
 import json
 
 
+# Add custom script path for importing the dataset and truncate helpers
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from dataset_manifest_github_version import *
+from preprocessing_cache_github_version import *
+
+# Import the parallel truncation pipeline
+from truncation_pipeline_github_version import *
+
 # Define the path to the dataset folder containing unpacked phishing data
 ws_path = "/workspace/dataset/unpacked_folder_phishing"
 
-# List all files/folders inside the dataset path
-files = os.listdir(ws_path)
-
-# Dictionary to store HTML content with folder names as keys
-all_html1 = {}
-
-# Iterate over each folder/file in the dataset path
-for filename in files:
-    # Construct the full path of the current item
-    p2 = os.path.join(ws_path, filename).replace("\\", "/")
-    
-    # List files within the current folder
-    wss = os.listdir(p2)
-    
-    # Iterate through files in the folder
-    for f1 in wss:
-        # Process only files ending with ".html"
-        if f1.endswith(".html"):
-            # Construct full path of the HTML file
-            file_path = os.path.join(p2, f1).replace("\\", "/")
-            
-            # Open the HTML file in read mode with UTF-8 encoding
-            with open(file_path, "r", encoding="utf-8") as f:
-                # Store the content in a dictionary with the folder name as key
-                all_html1[filename] = f.read()
-                
-                
-# Step 1: Initialize GPT-4 tokenizer using tiktoken
+# Token counts and truncations are cached by page content across runs
+cache_path = "/workspace/cache/preprocessing.sqlite"
+
+# Tokenizer for the manifest token counts
 model_name = "gpt-4"
-encoding = tiktoken.encoding_for_model(model_name)
 
-# Step 2: Count tokens for each HTML document
-doc_token_counts = {name: len(encoding.encode(doc)) for name, doc in all_html1.items()}
+# Truncation levels as shares of the original token count
+truncation_levels = [0.05, 0.50]
 
-# Step 3: Convert token counts into a pandas DataFrame
-df = pd.DataFrame(list(doc_token_counts.items()), columns=["doc_name", "token_count"])
+# HTML parser used by pre_clean_html: "html.parser", "lxml", "selectolax" or "stream"
+parser_backend = "html.parser"
 
-# Step 4: Split documents into 10 bins based on token counts (quantile-based binning)
-df["token_bin"] = pd.qcut(df["token_count"], q=10, labels=False)
+# Number of worker processes (None uses every core)
+workers = None
 
-# Step 5: Sample 500 documents in total, proportionally distributed across bins (50 per bin)
-sampled_df = df.groupby("token_bin", group_keys=False).apply(
-    lambda x: x.sample(n=int(500 / 10), random_state=42)  # random_state ensures reproducibility
-)
+# Truncations are streamed here, one line per document; rerunning the script
+# skips the documents already in this file
+out_path = '/workspace/dataset/temp/phish_truncations.jsonl'
 
-# Step 6: Extract only the sampled document names
-sampled_doc_names = sampled_df["doc_name"].tolist()
-print(f"Number of sampled document names: {len(sampled_doc_names)}")
+# Everything below runs only in the main process: with the spawn or forkserver
+# start method the truncation workers import this module again
+if __name__ == "__main__":
+    cache = PreprocessingCache(cache_path)
 
+    # Step 1: Index the dataset (path, size, content hash and GPT-4 token count per
+    # page) without keeping page contents in memory; unchanged pages are reused
+    # from the previous manifest
+    manifest = build_manifest(ws_path, model=model_name, cache=cache)
+    entries_by_name = {entry["doc_name"]: entry for entry in manifest}
 
-# Add custom script path for importing truncate functions
-ROOT = "/workspace/scripts"
-sys.path.append(ROOT)
+    # Step 2: Token counts for each HTML document, taken from the manifest (counted
+    # in multi-threaded batches); they serve both the binning below and the
+    # truncation budgets, so no document is encoded twice
+    doc_token_counts = {entry["doc_name"]: entry["token_count"] for entry in manifest}
+
+    # Step 3: Convert token counts into a pandas DataFrame
+    df = pd.DataFrame(list(doc_token_counts.items()), columns=["doc_name", "token_count"])
+
+    # Step 4: Split documents into 10 bins based on token counts (quantile-based binning)
+    df["token_bin"] = pd.qcut(df["token_count"], q=10, labels=False)
+
+    # Step 5: Sample 500 documents in total, proportionally distributed across bins (50 per bin)
+    sampled_df = df.groupby("token_bin", group_keys=False).apply(
+        lambda x: x.sample(n=int(500 / 10), random_state=42)  # random_state ensures reproducibility
+    )
+
+    # Step 6: Extract only the sampled document names
+    sampled_doc_names = sampled_df["doc_name"].tolist()
+    print(f"Number of sampled document names: {len(sampled_doc_names)}")
+
+    # Only process sampled documents, in a fixed order so the output does not
+    # depend on the number of workers
+    documents = [(name, entries_by_name[name]["path"], doc_token_counts[name], entries_by_name[name]["sha256"])
+                 for name in sorted(sampled_doc_names)]
+    run_truncation_pipeline(documents, out_path, truncation_levels, parser=parser_backend, workers=workers, cache=cache)
 
-# Import helper functions to truncate HTML by token length
-from truncate_html_functions_github_version import *
-
-# Dictionaries to store truncated versions of documents
-p5 = {}   # Stores 5% of tokens
-p50 = {}  # Stores 50% of tokens
-
-# Iterate over all documents
-for name, doc in all_html1.items():
-    if name in sampled_doc_names:  # Only process sampled documents
-        doc_len = len(encoding.encode(doc))  # Get token length of document
-        
-        # Truncate to 5% of original length
-        p5[name] = truncate_html_to_tokens_merged(doc, doc_len*0.05)
-        
-        # Truncate to 50% of original length
-        p50[name] = truncate_html_to_tokens_merged(doc, doc_len*0.50)
-        
-# Save the truncated 5% documents into JSON
-with open('/workspace/dataset/temp/phish_5.json', 'w') as fp:
-    json.dump(p5, fp)
-
-# Save the truncated 50% documents into JSON
-with open('/workspace/dataset/temp/phish_50.json', 'w') as fp:
-    json.dump(p50, fp)
-
-      
-
-        
+    # Save the truncated documents into one JSON per level (phish_5.json, phish_50.json, ...)
+    for level in truncation_levels:
+        with open(f'/workspace/dataset/temp/phish_{round(level * 100)}.json', 'w') as fp:
+            json.dump(read_truncations(out_path, level), fp)
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+import tempfile
+from html import escape
+from html.parser import HTMLParser
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import shorten_href, shorten_src
+
+# -------------------------
+# Streaming pre-cleaning
+# -------------------------
+# Event-driven first pass over the raw page that never builds a tree: the page
+# is read in chunks by a small tokenizer that follows html.parser's rules for
+# where tags, comments and <script>/<style> contents start and end.
+# Script/style contents and comments are skipped (comments are held in a
+# bounded buffer until they close, see below), the
+# href of <a> and src of <img> are shortened with the rules of pre_clean_html
+# (idempotent, so pre_clean_html leaves them as they are), and text and all
+# other markup are passed through unchanged; a "<" that starts no markup is
+# written as "&lt;" so that it cannot start a tag once a dropped region is
+# gone. Quoted attribute values are kept to their first ``max_attr_chars``
+# characters while they are read, so inline base64 images or scripts in
+# attributes never sit in memory whole; the shortening rules only look at the
+# first 100 characters, and any other value over max_attr_chars is cut and
+# marked with "...". Memory use is bounded by the chunk size and
+# max_attr_chars whatever the size of the page; only the whitespace inside an
+# unfinished end of comment ("--   >") or end tag ("</script   >") is held
+# until the next chunk shows whether it completes.
+#
+# A comment that is never closed is handled as html.parser does: "<!--" up
+# to the next ">" becomes text and the rest of the page is parsed as usual
+# (every later "<!--" is then unclosed too). Whether a comment is closed is
+# only known at its end or at the end of the page, so while a long comment is
+# open that reading is cleaned alongside and spooled to a temporary file.
+#
+# The output is a much smaller document for pre_clean_html, which parses it
+# the same way as the original: pre_clean_html(stream_pre_clean(page)) equals
+# pre_clean_html(page) except for attribute values over max_attr_chars and
+# character references in the last max_attr_chars or more characters of a page
+# that end in an unclosed comment with no ">" after it. The comment rules are
+# those of html.parser up to Python 3.12 (a comment ends at "--" and ">" with
+# only whitespace between); newer versions also end it at "--!>".
+
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_ATTR_CHARS = 4096
+
+_RAW_TEXT_TAGS = ("script", "style")
+_END_TAG_RE = re.compile(r"</([a-zA-Z][^\t\n\r\f />\x00]*)")
+_COMMENT_END_RE = re.compile(r"--\s*>")
+_RAW_END_RES = {name: re.compile(r"</\s*%s\s*>" % name, re.I) for name in _RAW_TEXT_TAGS}
+# Unfinished end of a script/style block at the end of the buffer
+_RAW_END_START_RE = re.compile(r"</\s*([a-zA-Z]*)\s*\Z")
+# Opening quote of an attribute value, or the end of the tag
+_TAG_SCAN_RE = re.compile(r"""=+\s*(["'])|>""")
+
+def _end_marker_start(buf, pos, state, raw_tag):
+    # Where an end of comment ("--" and ">" with only whitespace between) or
+    # of a script/style block that the next chunk may finish starts in
+    # buf[pos:]; everything before it can be dropped. A lone trailing "-" or
+    # "<" is kept, as it may start the marker
+    if state == "comment":
+        k = buf.rfind("--", pos)
+        if k != -1 and not buf[k + 2:].strip():
+            return k
+    else:
+        k = buf.rfind("</", pos)
+        m = _RAW_END_START_RE.match(buf, k) if k != -1 else None
+        if m:
+            name = m.group(1).lower()
+            # Whitespace may only follow the full name (or come before it)
+            complete = name in ("", raw_tag) or m.end(1) == m.end()
+            if raw_tag.startswith(name) and complete:
+                return k
+    return max(pos, len(buf) - 1)
+
+# Characters of an open comment kept in memory before its unclosed reading
+# is cleaned alongside (and spooled to disk past the same size)
+_COMMENT_BUFFER_CHARS = 64 * 1024
+
+class _TagReader(HTMLParser):
+    # Parses one start tag with html.parser's own rules (names lowercased,
+    # character references in values resolved)
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.result = None
+
+    def handle_starttag(self, tag, attrs):
+        self.result = (tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self.result = (tag, attrs, True)
+
+    def read(self, text):
+        self.reset()
+        self.result = None
+        self.feed(text)
+        return self.result
+
+
+class _TextReader(HTMLParser):
+    # Text html.parser makes of markup that holds no complete tag
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.data = []
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def read(self, text):
+        self.reset()
+        self.data = []
+        self.feed(text)
+        self.close()
+        return "".join(self.data)
+
+
+class _UnclosedComment:
+    # The cleaned page from an open comment on, as it is if the comment is
+    # never closed. A short comment is only buffered; a long one is cleaned
+    # as it is read, into a spooled temporary file
+
+    def __init__(self, max_attr_chars):
+        self.max_attr_chars = max_attr_chars
+        self.pending = []
+        self.pending_len = 0
+        self.cleaner = None
+        self.spool = None
+
+    def feed(self, text):
+        if self.cleaner is None:
+            self.pending.append(text)
+            self.pending_len += len(text)
+            if self.pending_len <= _COMMENT_BUFFER_CHARS:
+                return
+            self.cleaner = StreamPreCleaner(self.max_attr_chars, unclosed_comment=True)
+            self.spool = tempfile.SpooledTemporaryFile(max_size=_COMMENT_BUFFER_CHARS, mode="w+", encoding="utf-8")
+            text, self.pending = "".join(self.pending), None
+        self.spool.write(self.cleaner.feed(text))
+
+    def discard(self):
+        if self.spool is not None:
+            self.spool.close()
+
+    def close_chunks(self):
+        if self.cleaner is None:
+            self.cleaner = StreamPreCleaner(self.max_attr_chars, unclosed_comment=True)
+            yield self.cleaner.feed("".join(self.pending))
+        else:
+            self.spool.seek(0)
+            while True:
+                chunk = self.spool.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            self.spool.close()
+        yield from self.cleaner.close_chunks()
+
+
+class StreamPreCleaner:
+    """
+    Incremental cleaner: ``feed(chunk)`` returns the cleaned markup that is
+    complete so far, ``close()`` the rest (``close_chunks()`` yields it in
+    pieces). ``unclosed_comment`` starts right after the "<!--" of a comment
+    that is never closed.
+    """
+
+    def __init__(self, max_attr_chars=MAX_ATTR_CHARS, unclosed_comment=False):
+        self.max_attr_chars = max(max_attr_chars, 101)
+        self.buf = ""
+        # After an unclosed comment no comment is closed either
+        self.unclosed_comment = unclosed_comment
+        self.state = "unclosed_comment" if unclosed_comment else "text"
+        # "<!--" of an unclosed comment not written yet
+        self.comment_start = unclosed_comment
+        self.comment = None
+        self.raw_tag = None
+        self.tag = []
+        self.tag_len = 0
+        self.quote = None
+        self.value_len = 0
+        self.reader = _TagReader()
+
+    def feed(self, chunk: str) -> str:
+        self.buf += chunk
+        return self._run(final=False)
+
+    def close_chunks(self):
+        yield self._run(final=True)
+        if self.state == "comment":
+            yield from self.comment.close_chunks()
+        elif self.state == "tag":
+            # Never closed: html.parser keeps it as text
+            yield "".join(self.tag) + self.buf
+        elif self.state == "text":
+            yield self.buf
+        elif self.comment_start:
+            # Unclosed comment at the very end of the page
+            yield "&lt;!--"
+        self.buf = ""
+
+    def close(self) -> str:
+        return "".join(self.close_chunks())
+
+    # -------------------------
+    # Tokenizer
+    # -------------------------
+    def _run(self, final):
+        out = []
+        buf, pos = self.buf, 0
+        while pos < len(buf):
+            if self.state == "text":
+                j = buf.find("<", pos)
+                if j == -1:
+                    out.append(buf[pos:])
+                    pos = len(buf)
+                    break
+                out.append(buf[pos:j])
+                pos = j
+                if len(buf) - j < 4 and not final:
+                    break
+                end_tag = _END_TAG_RE.match(buf, j)
+                if buf.startswith("<!--", j):
+                    if self.unclosed_comment:
+                        self.state, self.comment_start = "unclosed_comment", True
+                    else:
+                        self.state = "comment"
+                        self.comment = _UnclosedComment(self.max_attr_chars)
+                    pos = j + 4
+                elif end_tag:
+                    k = buf.find(">", j)
+                    if k == -1:
+                        if not final and len(buf) - j < self.max_attr_chars:
+                            break
+                        out.append("&lt;")
+                        pos = j + 1
+                    else:
+                        if end_tag.group(1).lower() not in _RAW_TEXT_TAGS:
+                            out.append(buf[j:k + 1])
+                        pos = k + 1
+                elif buf[j + 1:j + 2] in ("!", "?", "/"):
+                    # Declarations (doctype), processing instructions and end
+                    # tags html.parser reads leniently ("</ p>"), as they are
+                    k = buf.find(">", j)
+                    if k == -1:
+                        if not final and len(buf) - j < self.max_attr_chars:
+                            break
+                        out.append("&lt;")
+                        pos = j + 1
+                    else:
+                        out.append(buf[j:k + 1])
+                        pos = k + 1
+                elif buf[j + 1:j + 2].isascii() and buf[j + 1:j + 2].isalpha():
+                    self.state = "tag"
+                    self.tag, self.tag_len, self.quote = [], 0, None
+                else:
+                    out.append("&lt;")
+                    pos = j + 1
+            elif self.state == "tag":
+                pos = self._scan_tag(buf, pos, final, out)
+                if self.state == "tag":
+                    break
+            elif self.state == "comment":
+                m = _COMMENT_END_RE.search(buf, pos)
+                if m is None:
+                    end = len(buf) if final else _end_marker_start(buf, pos, self.state, self.raw_tag)
+                    self.comment.feed(buf[pos:end])
+                    pos = end
+                    break
+                self.comment.discard()
+                self.comment = None
+                self.state = "text"
+                pos = m.end()
+            elif self.state == "unclosed_comment":
+                # Text up to and including the next ">" (character
+                # references are not resolved in it). With no ">" up to the
+                # end of the page html.parser reads the rest differently, so
+                # it is handed to html.parser itself
+                k = buf.find(">", pos)
+                if k == -1 and self.comment_start:
+                    if final:
+                        out.append(escape(_TextReader().read("<!--" + buf[pos:]), quote=False))
+                        self.comment_start = False
+                        pos = len(buf)
+                        break
+                    if len(buf) - pos < self.max_attr_chars:
+                        break
+                end = len(buf) if k == -1 else k + 1
+                out.append(escape(("<!--" if self.comment_start else "") + buf[pos:end], quote=False))
+                self.comment_start = False
+                pos = end
+                if k != -1:
+                    self.state = "text"
+            else:
+                m = _RAW_END_RES[self.raw_tag].search(buf, pos)
+                if m is None:
+                    pos = len(buf) if final else _end_marker_start(buf, pos, self.state, self.raw_tag)
+                    break
+                self.state = "text"
+                pos = m.end()
+        self.buf = buf[pos:]
+        return "".join(out)
+
+    def _keep(self, piece):
+        self.tag.append(piece)
+        self.tag_len += len(piece)
+
+    def _scan_tag(self, buf, pos, final, out):
+        while True:
+            if self.quote:
+                k = buf.find(self.quote, pos)
+                end = len(buf) if k == -1 else k
+                room = self.max_attr_chars - self.value_len
+                if room > 0:
+                    self._keep(buf[pos:min(end, pos + room)])
+                self.value_len += end - pos
+                if k == -1:
+                    return len(buf)
+                if self.value_len > self.max_attr_chars:
+                    self._keep("...")
+                self._keep(self.quote)
+                self.quote = None
+                pos = k + 1
+                continue
+            m = _TAG_SCAN_RE.search(buf, pos)
+            if m is None:
+                # Hold back a trailing "=" whose quote may be in the next chunk
+                cut = len(buf)
+                eq = buf.rfind("=", pos)
+                if eq != -1 and not buf[eq + 1:].strip() and not final:
+                    cut = eq
+                self._keep(buf[pos:cut])
+                if self.tag_len > 16 * self.max_attr_chars:
+                    # Not a tag html.parser would recognise either; pass it on as text
+                    out.append("".join(self.tag))
+                    self.state = "text"
+                return cut
+            self._keep(buf[pos:m.end()])
+            pos = m.end()
+            if m.group(1):
+                self.quote, self.value_len = m.group(1), 0
+                continue
+            out.append(self._finish_tag("".join(self.tag)))
+            return pos
+
+    def _finish_tag(self, text):
+        self.state = "text"
+        parsed = self.reader.read(text)
+        if parsed is None:
+            return text
+        name, attrs, self_closing = parsed
+        if name in _RAW_TEXT_TAGS:
+            if not self_closing:
+                self.state, self.raw_tag = "raw", name
+            return ""
+        parts = ["<", name]
+        for key, value in attrs:
+            if value is None:
+                parts.append(f" {key}")
+                continue
+            if key == "href" and name == "a":
+                value = shorten_href(value)
+            elif key == "src" and name == "img":
+                value = shorten_src(value)
+            parts.append(f' {key}="{escape(value, quote=True)}"')
+        parts.append("/>" if self_closing else ">")
+        return "".join(parts)
+
+
+def _chunks(source, chunk_size):
+    if isinstance(source, str):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from source
+
+def stream_pre_clean(source, out=None, chunk_size=STREAM_CHUNK_SIZE, max_attr_chars=MAX_ATTR_CHARS):
+    """
+    Streaming pre-clean of ``source``: a string, a text file object (read
+    ``chunk_size`` characters at a time) or an iterable of string chunks.
+    The cleaned markup is written to ``out`` (file object) as it is produced,
+    or returned as a string.
+    """
+    cleaner = StreamPreCleaner(max_attr_chars)
+    pieces = []
+    write = out.write if out is not None else pieces.append
+    for chunk in _chunks(source, chunk_size):
+        cleaned = cleaner.feed(chunk)
+        if cleaned:
+            write(cleaned)
+    for cleaned in cleaner.close_chunks():
+        write(cleaned)
+    return None if out is not None else "".join(pieces)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import get_encoding
+
+# -------------------------
+# Batched token counting
+# -------------------------
+def iter_token_counts(texts, model: str = "", num_threads: int = None, batch_size: int = 64):
+    """
+    Yields the token count of every text in ``texts`` (any iterable, consumed
+    lazily), in order. Texts are encoded ``batch_size`` at a time with
+    tiktoken's multi-threaded encode_batch, which releases the GIL, and only
+    the lengths are kept: the token lists of a batch are dropped before the
+    next batch is read. Counts equal len(encoding.encode(text)).
+    """
+    encoding = get_encoding(model)
+    num_threads = num_threads or os.cpu_count()
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= batch_size:
+            yield from (len(tokens) for tokens in encoding.encode_batch(batch, num_threads=num_threads))
+            batch = []
+    if batch:
+        yield from (len(tokens) for tokens in encoding.encode_batch(batch, num_threads=num_threads))
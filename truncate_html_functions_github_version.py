@@ -3,6 +3,9 @@
 from bs4 import BeautifulSoup, Tag, NavigableString, Comment
 from urllib.parse import urlparse
 from copy import copy
+from functools import lru_cache
+import heapq
+import re
 import uuid
 import tiktoken
 
@@ -18,6 +21,15 @@ def extract_domain(url: str) -> str:
 def extract_url_from_tag(tag: Tag) -> str:
     return tag.get("href") or tag.get("src") or str(uuid.uuid1())
 
+# Encoders are looked up once per process and model
+@lru_cache(maxsize=None)
+def get_encoding(model: str = ""):
+    return tiktoken.encoding_for_model(model or "gpt-4")
+
+# Bump whenever a change alters truncation output, so cached truncations of
+# older versions are not reused
+PIPELINE_VERSION = "1"
+
 # -------------------------
 # Importance scoring
 # -------------------------
@@ -28,42 +40,167 @@ CRITICAL_TAGS = {"title", "h1", "h2", "h3", "h4", "h5", "h6",
                  "p", "strong", "a", "img", "hr", "table", "tbody", "tr",
                  "th", "td", "ol", "ul", "li", "ruby", "label", "head", "body", "meta", "link"}
 
-def get_importance_score(tag: Tag) -> int:
+LAYOUT_TAGS = {"div", "span", "section", "article", "aside", "footer", "header"}
+
+# Scoring rules compiled once: a tag-name -> score table plus one pattern per
+# keyword list, instead of any(...) scans over the lists for every tag
+_TAG_SCORES = {**{n: 1 for n in LAYOUT_TAGS}, "html": 2, "head": 2, **{n: 3 for n in CRITICAL_TAGS}}
+_PHISHING_KEYWORDS_RE = re.compile("|".join(re.escape(k) for k in PHISHING_KEYWORDS))
+_BRAND_IMG_KEYWORDS_RE = re.compile("|".join(re.escape(k) for k in BRAND_IMG_KEYWORDS))
+_META_NAMES = {"description", "keywords", "viewport"}
+_LINK_RELS = {"icon", "stylesheet", "canonical"}
+
+def get_importance_score(tag: Tag, has_text: bool = None) -> int:
     name = tag.name or ""
     name_lower = name.lower()
+    score = _TAG_SCORES.get(name_lower)
 
     # Score 3: Paper's critical tags + phishing cues
-    if name_lower in CRITICAL_TAGS:
-        if name_lower == "a" and any(k in tag.get("href", "").lower() for k in PHISHING_KEYWORDS):
+    if score == 3:
+        if name_lower == "a" and _PHISHING_KEYWORDS_RE.search(tag.get("href", "").lower()):
             return 3
-        if name_lower == "img" and any(k in (tag.get("alt", "") + tag.get("src", "")).lower() for k in BRAND_IMG_KEYWORDS):
+        if name_lower == "img" and _BRAND_IMG_KEYWORDS_RE.search((tag.get("alt", "") + tag.get("src", "")).lower()):
             return 3
-        if name_lower == "meta" and (tag.get("name") or "").lower() in ["description", "keywords", "viewport"]:
+        if name_lower == "meta" and (tag.get("name") or "").lower() in _META_NAMES:
             return 3
         if name_lower == "meta" and (tag.get("property") or "").lower().startswith(("og:", "twitter:")):
             return 3
-        if name_lower == "link" and any(x in [r.lower() for r in (tag.get("rel") or [])] for x in ["icon", "stylesheet", "canonical"]):
+        if name_lower == "link" and any(r.lower() in _LINK_RELS for r in (tag.get("rel") or [])):
             return 3
         return 3  # Paper's critical list default
 
     # Score 2: Layout/structural tags with potential context
-    if name_lower in {"html", "head"}:
-        return 2
-
     # Score 1: Keep content but unwrap to save space
-    if name_lower in {"div", "span", "section", "article", "aside", "footer", "header"}:
-        return 1
+    if score is not None:
+        return score
 
     # Score 0: Junk
-    if not tag.get_text(strip=True) and not tag.attrs:
+    if has_text is None:
+        has_text = bool(tag.get_text(strip=True))
+    if not has_text and not tag.attrs:
         return 0
     return 1
 
+# -------------------------
+# Score index
+# -------------------------
+class ScoreIndex:
+    """
+    Single scoring pass over a tree. For every tag it records the importance
+    score, the document order, whether its subtree holds any text (as
+    get_text(strip=True) would report) and ``rank``: the position of the first
+    tag that compares equal to it, which is what all_tags.index(tag) returns.
+    Equal subtrees are found by hash-consing (name, attrs, children) bottom-up.
+    """
+
+    def __init__(self, soup: BeautifulSoup):
+        self.tags = list(soup.find_all())
+        self.order = {id(t): i for i, t in enumerate(self.tags)}
+        self.has_text = {}
+        self.score = {}
+        self.rank = {}
+
+        shapes = {}
+        shape_of = {}
+        first_of_shape = {}
+        # Reverse document order visits every child before its parent
+        for tag in reversed(self.tags):
+            has_text = False
+            children = []
+            for child in tag.contents:
+                if isinstance(child, Tag):
+                    has_text = has_text or self.has_text[id(child)]
+                    children.append(shape_of[id(child)])
+                else:
+                    if type(child) in Tag.MAIN_CONTENT_STRING_TYPES and child.strip():
+                        has_text = True
+                    children.append(str(child))
+            attrs = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in tag.attrs.items()))
+            shape_of[id(tag)] = shapes.setdefault((tag.name, attrs, tuple(children)), len(shapes))
+            self.has_text[id(tag)] = has_text
+            self.score[id(tag)] = get_importance_score(tag, has_text)
+
+        for i, tag in enumerate(self.tags):
+            self.rank[id(tag)] = first_of_shape.setdefault(shape_of[id(tag)], i)
+
+    def is_empty(self, tag: Tag) -> bool:
+        return not self.has_text[id(tag)] and not tag.attrs
+
+# -------------------------
+# Parser backends
+# -------------------------
+def _parse_html_parser(html: str) -> BeautifulSoup:
+    return BeautifulSoup(html, "html.parser")
+
+def _parse_lxml(html: str) -> BeautifulSoup:
+    return BeautifulSoup(html, "lxml")
+
+def _parse_selectolax(html: str) -> BeautifulSoup:
+    """
+    lexbor (C) parses the page and drops <script>, <style> and comments, the
+    bulk of most phishing kits. The stripped tree is then serialized and
+    parsed again with html.parser to build the soup, so the pure-Python parse
+    still runs on every page; it is only faster when stripping shrinks the
+    page a lot.
+    """
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style"])
+    for node in [n for n in tree.root.traverse(include_text=True) if n.tag == "-comment"]:
+        node.decompose()
+    return BeautifulSoup(tree.html or "", "html.parser")
+
+def _parse_stream(html: str) -> BeautifulSoup:
+    # Event-driven first pass (stream_pre_clean_github_version.py) drops
+    # <script>, <style> and comments and shortens href/src without building a
+    # tree; BeautifulSoup only builds the remaining document
+    from stream_pre_clean_github_version import stream_pre_clean
+    return BeautifulSoup(stream_pre_clean(html), "html.parser")
+
+# lxml and selectolax build the tree the way browsers do (HTML5 tree
+# construction); see check_parser_backends_github_version.py for how their
+# output differs from html.parser
+PARSER_BACKENDS = {
+    "html.parser": _parse_html_parser,
+    "lxml": _parse_lxml,
+    "selectolax": _parse_selectolax,
+    "stream": _parse_stream,
+}
+
+def available_parser_backends() -> list:
+    available = ["html.parser", "stream"]
+    for name, module in [("lxml", "lxml"), ("selectolax", "selectolax.lexbor")]:
+        try:
+            __import__(module)
+            available.append(name)
+        except ImportError:
+            pass
+    return available
+
 # -------------------------
 # Pre-cleaning step
 # -------------------------
-def pre_clean_html(html: str) -> BeautifulSoup:
-    soup = BeautifulSoup(html, "html.parser")
+# href/src shortening rules; applying them twice gives the same value, so the
+# streaming pre-cleaner can apply them before pre_clean_html does
+def shorten_href(href: str) -> str:
+    if href.startswith("http"):
+        domain = extract_domain(href)
+        return domain if len(href) > 50 else href
+    if len(href) > 50:
+        return href[:47] + "..."
+    return href
+
+def shorten_src(src: str) -> str:
+    if src.startswith("data:image") and len(src) > 100:
+        return src[:97] + "..."
+    if len(src) > 100:
+        return src[:97] + "..."
+    return src
+
+def pre_clean_html(html: str, parser: str = "html.parser") -> BeautifulSoup:
+    if parser not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend {parser!r}, expected one of {list(PARSER_BACKENDS)}")
+    soup = PARSER_BACKENDS[parser](html)
 
     # Remove <style>, <script>, and comments
     for el in soup(["style", "script"]):
@@ -71,65 +208,150 @@ def pre_clean_html(html: str) -> BeautifulSoup:
     for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
         comment.extract()
 
+    # Scores and subtree emptiness do not change while tags are unwrapped or
+    # empty subtrees removed, so one index serves both passes
+    index = ScoreIndex(soup)
+
     # Unwrap/remove based on importance
-    for tag in soup.find_all():
-        score = get_importance_score(tag)
+    for tag in index.tags:
+        if tag.decomposed:
+            continue
+        score = index.score[id(tag)]
         if score == 0:
             tag.decompose()
         elif score == 1:
             tag.unwrap()
 
     # Remove empty elements
-    for tag in soup.find_all():
-        if not tag.get_text(strip=True) and not tag.attrs:
+    for tag in index.tags:
+        if tag.decomposed or tag.parent is None:
+            continue
+        if index.is_empty(tag):
             tag.decompose()
 
     # Shorten href/src
     for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href.startswith("http"):
-            domain = extract_domain(href)
-            a["href"] = domain if len(href) > 50 else href
-        elif len(href) > 50:
-            a["href"] = href[:47] + "..."
+        a["href"] = shorten_href(a["href"])
 
     for img in soup.find_all("img", src=True):
-        src = img["src"]
-        if src.startswith("data:image") and len(src) > 100:
-            img["src"] = src[:97] + "..."
-        elif len(src) > 100:
-            img["src"] = src[:97] + "..."
+        img["src"] = shorten_src(img["src"])
 
     return soup
 
+# -------------------------
+# Token budget accounting
+# -------------------------
+# Tokens a single fragment boundary may gain or lose when fragments are
+# encoded separately instead of as one document (BPE merges such as "><").
+BOUNDARY_MERGE_SLACK = 2
+
+class TokenBudgetAccountant:
+    """
+    Tracks the token count of a growing document without re-encoding it
+    after every append.
+
+    The running estimate is the exact count at the last sync plus the token
+    cost of every fragment appended since. Each append adds two boundaries,
+    and each boundary may shift the true count by at most ``slack`` tokens,
+    so the document is only re-encoded once that uncertainty band reaches
+    ``max_tokens``. Tolerance: as long as no boundary merge exceeds ``slack``
+    tokens, ``reached()`` returns exactly what a full re-encode would.
+    """
+
+    def __init__(self, encoding, max_tokens, render, slack: int = BOUNDARY_MERGE_SLACK):
+        self.encoding = encoding
+        self.max_tokens = max_tokens
+        self.render = render  # returns the current document as a string
+        self.slack = slack
+        self.full_encodes = 0
+        self.sync()
+
+    def sync(self) -> int:
+        self.synced = len(self.encoding.encode(self.render()))
+        self.pending = 0
+        self.boundaries = 0
+        self.full_encodes += 1
+        return self.synced
+
+    def estimate(self) -> int:
+        return self.synced + self.pending
+
+    def add(self, fragment: str) -> None:
+        self.pending += len(self.encoding.encode(fragment))
+        self.boundaries += 2
+
+    def reached(self) -> bool:
+        margin = self.slack * self.boundaries
+        if self.estimate() + margin < self.max_tokens:
+            return False
+        if self.estimate() - margin >= self.max_tokens:
+            return True
+        return self.sync() >= self.max_tokens
+
 # -------------------------
 # Scored element extraction
 # -------------------------
-def extract_scored_elements(soup: BeautifulSoup, max_tokens: int, model: str = "") -> BeautifulSoup:
+def scored_element_order(soup: BeautifulSoup, index: ScoreIndex = None) -> list:
+    index = index or ScoreIndex(soup)
+    return sorted(index.tags, key=lambda t: (-index.score[id(t)], index.rank[id(t)]))
+
+def _append_clone(reduced: BeautifulSoup, tag: Tag) -> Tag:
+    cloned = copy(tag)
+    cloned.clear()
+    if tag.string:
+        cloned.append(NavigableString(tag.string))
+    target_parent = reduced.head if tag.name in ["title", "meta", "link"] else reduced.body
+    target_parent.append(cloned)
+    return cloned
+
+def extract_scored_elements(soup: BeautifulSoup, max_tokens: int, model: str = "", index: ScoreIndex = None) -> BeautifulSoup:
     reduced = BeautifulSoup("<html><head></head><body></body></html>", "html.parser")
-    all_tags = list(soup.find_all())
-    scored_tags = [(get_importance_score(tag), tag) for tag in all_tags]
-    scored_tags.sort(key=lambda x: (-x[0], all_tags.index(x[1])))
-
-    encoding = tiktoken.encoding_for_model(model or "gpt-4")
-
-    for score, tag in scored_tags:
-        cloned = copy(tag)
-        cloned.clear()
-        if tag.string:
-            cloned.append(NavigableString(tag.string))
-        target_parent = reduced.head if tag.name in ["title", "meta", "link"] else reduced.body
-        target_parent.append(cloned)
-        if len(encoding.encode(str(reduced))) >= max_tokens:
+    encoding = get_encoding(model)
+    budget = TokenBudgetAccountant(encoding, max_tokens, lambda: str(reduced))
+
+    for tag in scored_element_order(soup, index):
+        cloned = _append_clone(reduced, tag)
+        budget.add(str(cloned))
+        if budget.reached():
             break
 
     return reduced
 
+def extract_scored_elements_multi(soup: BeautifulSoup, budgets: list, model: str = "", index: ScoreIndex = None) -> dict:
+    """
+    extract_scored_elements for several budgets in one pass. The reduced
+    document for a budget is a prefix of the one for any larger budget, so a
+    single growing document is snapshotted each time it reaches the next
+    budget. Returns {budget: serialized reduced document}.
+    """
+    reduced = BeautifulSoup("<html><head></head><body></body></html>", "html.parser")
+    encoding = get_encoding(model)
+    pending = sorted(set(budgets))
+    snapshots = {}
+    if not pending:
+        return snapshots
+    budget = TokenBudgetAccountant(encoding, pending[0], lambda: str(reduced))
+
+    for tag in scored_element_order(soup, index):
+        cloned = _append_clone(reduced, tag)
+        budget.add(str(cloned))
+        while pending and budget.reached():
+            snapshots[pending.pop(0)] = str(reduced)
+            if pending:
+                budget.max_tokens = pending[0]
+        if not pending:
+            break
+
+    # Budgets larger than the whole reduced document
+    for max_tokens in pending:
+        snapshots[max_tokens] = str(reduced)
+    return snapshots
+
 # -------------------------
 # Hybrid trimming
 # -------------------------
 def hybrid_trim(soup: BeautifulSoup, max_tokens: int, model: str = "") -> BeautifulSoup:
-    encoding = tiktoken.encoding_for_model(model or "gpt-4")
+    encoding = get_encoding(model)
     def token_len(): return len(encoding.encode(str(soup)))
 
     while token_len() > max_tokens:
@@ -149,20 +371,119 @@ def hybrid_trim(soup: BeautifulSoup, max_tokens: int, model: str = "") -> Beauti
         all_tags[len(all_tags) // 2].decompose()
     return soup
 
+# -------------------------
+# Heap-based trimming
+# -------------------------
+# Never removed by heap_trim: dropping one of these empties the document
+TRIM_PROTECTED_TAGS = {"html", "head", "body"}
+
+def heap_trim(soup: BeautifulSoup, max_tokens: int, model: str = "") -> BeautifulSoup:
+    """
+    Same goal as hybrid_trim, but the removal candidates are scored once and
+    kept in a heap ordered by (importance score, most frequent tag name first,
+    document order). Candidates are removed in geometric batches (1, 2, 4, ...)
+    with one re-encode per batch; once a batch fits the budget, a binary search
+    over that batch finds the smallest number of removals that fits.
+    """
+    encoding = get_encoding(model)
+    def token_len(): return len(encoding.encode(str(soup)))
+
+    if token_len() <= max_tokens:
+        return soup
+
+    candidates = [t for t in soup.find_all() if t.name not in TRIM_PROTECTED_TAGS]
+    name_counts = {}
+    for t in candidates:
+        name_counts[t.name] = name_counts.get(t.name, 0) + 1
+    index = ScoreIndex(soup)
+    heap = [(index.score[id(t)], -name_counts[t.name], i, t) for i, t in enumerate(candidates)]
+    heapq.heapify(heap)
+
+    taken = []    # candidates in removal order
+    removed = []  # (tag, parent, position) of the currently extracted prefix of taken
+    removed_ids = set()
+
+    def remove_next(tag):
+        parent = tag.parent
+        removed.append((tag, parent, parent.index(tag)))
+        removed_ids.add(id(tag))
+        tag.extract()
+
+    def set_removed(k):
+        while len(removed) > k:
+            tag, parent, position = removed.pop()
+            removed_ids.discard(id(tag))
+            parent.insert(position, tag)
+        while len(removed) < k:
+            remove_next(taken[len(removed)])
+
+    fits_at, last_too_long = None, 0
+    batch = 1
+    while heap and fits_at is None:
+        pulled = 0
+        while heap and pulled < batch:
+            tag = heapq.heappop(heap)[3]
+            # Already gone together with a removed ancestor
+            if any(id(p) in removed_ids for p in tag.parents):
+                continue
+            taken.append(tag)
+            remove_next(tag)
+            pulled += 1
+        if token_len() <= max_tokens:
+            fits_at = len(taken)
+        else:
+            last_too_long = len(taken)
+            batch *= 2
+
+    if fits_at is None:
+        return soup
+
+    lo, hi = last_too_long, fits_at
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        set_removed(mid)
+        if token_len() <= max_tokens:
+            hi = mid
+        else:
+            lo = mid
+    set_removed(hi)
+    return soup
+
 # -------------------------
 # Full truncation pipeline
 # -------------------------
-def truncate_html_to_tokens_merged(html: str, max_tokens: int = 1000, model: str = "") -> str:
-    cleaned_soup = pre_clean_html(html)
-    encoding = tiktoken.encoding_for_model(model or "gpt-4")
+def truncate_html_to_tokens_merged(html: str, max_tokens: int = 1000, model: str = "", parser: str = "html.parser") -> str:
+    cleaned_soup = pre_clean_html(html, parser)
+    encoding = get_encoding(model)
 
     if len(encoding.encode(str(cleaned_soup))) <= max_tokens:
         return str(cleaned_soup)
 
-    reduced_soup = extract_scored_elements(cleaned_soup, max_tokens, model)
+    reduced_soup = extract_scored_elements(cleaned_soup, max_tokens, model, ScoreIndex(cleaned_soup))
 
     if len(encoding.encode(str(reduced_soup))) > max_tokens:
-        reduced_soup = hybrid_trim(reduced_soup, max_tokens, model)
+        reduced_soup = heap_trim(reduced_soup, max_tokens, model)
 
 
     return str(reduced_soup)
+
+def truncate_html_to_tokens_multi(html: str, budgets: list, model: str = "", parser: str = "html.parser") -> list:
+    """
+    truncate_html_to_tokens_merged for several budgets from a single parse.
+    The cleaned tree, its token count and the scored element order are shared
+    by all budgets. Returns the truncations in the order of ``budgets``.
+    """
+    cleaned_soup = pre_clean_html(html, parser)
+    encoding = get_encoding(model)
+    cleaned_html = str(cleaned_soup)
+    cleaned_len = len(encoding.encode(cleaned_html))
+
+    to_reduce = [b for b in budgets if cleaned_len > b]
+    reduced = extract_scored_elements_multi(cleaned_soup, to_reduce, model, ScoreIndex(cleaned_soup))
+
+    truncated = {}
+    for max_tokens, reduced_html in reduced.items():
+        reduced_soup = BeautifulSoup(reduced_html, "html.parser")
+        truncated[max_tokens] = str(heap_trim(reduced_soup, max_tokens, model))
+
+    return [truncated.get(b, cleaned_html) for b in budgets]
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = "/workspace/scripts"
+sys.path.append(ROOT)
+
+from truncate_html_functions_github_version import *
+from stream_pre_clean_github_version import stream_pre_clean
+
+# -------------------------
+# Worker
+# -------------------------
+def truncate_document(job: tuple) -> dict:
+    """
+    Truncates one document to every level. ``job`` is
+    (doc_name, path, doc_tokens, levels, parser); the worker reads the file
+    itself so that page contents never travel through the parent process.
+    """
+    doc_name, path, doc_tokens, levels, parser = job
+    with open(path, "r", encoding="utf-8") as f:
+        if parser == "stream":
+            # Cleaned while reading, so the whole page is never in memory;
+            # html.parser on the result is what the "stream" backend does
+            doc, parser = stream_pre_clean(f), "html.parser"
+        else:
+            doc = f.read()
+    budgets = [doc_tokens * level for level in levels]
+    truncations = truncate_html_to_tokens_multi(doc, budgets, parser=parser)
+    return {
+        "doc_name": doc_name,
+        "doc_tokens": doc_tokens,
+        "truncations": {str(level): out for level, out in zip(levels, truncations)},
+    }
+
+# -------------------------
+# Output log
+# -------------------------
+def completed_documents(out_path: str, levels: list = None) -> set:
+    """Names of the documents already in the JSONL output, with every one of
+    ``levels`` if given. A torn last line left by a crash is cut off so that
+    appending starts on a clean line."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    valid_end = 0
+    with open(out_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+                doc_name, logged = record["doc_name"], record["truncations"]
+            except (ValueError, KeyError):
+                break
+            if levels is None or all(str(level) in logged for level in levels):
+                done.add(doc_name)
+            valid_end += len(line)
+    if valid_end != os.path.getsize(out_path):
+        with open(out_path, "r+b") as f:
+            f.truncate(valid_end)
+    return done
+
+def read_truncations(out_path: str, level: float) -> dict:
+    """{doc_name: truncated html} for one level, the format of phish_5.json.
+    A document logged more than once (re-run with other levels) gives its
+    latest record holding ``level``."""
+    truncated = {}
+    missing = set()
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if str(level) in record["truncations"]:
+                truncated[record["doc_name"]] = record["truncations"][str(level)]
+                missing.discard(record["doc_name"])
+            elif record["doc_name"] not in truncated:
+                missing.add(record["doc_name"])
+    if missing:
+        raise ValueError(f"{len(missing)} documents in {out_path} were truncated without level {level} "
+                         f"(e.g. {sorted(missing)[0]}); rerun run_truncation_pipeline with it in levels")
+    return truncated
+
+# -------------------------
+# Pipeline
+# -------------------------
+def _pipeline_key(parser: str) -> str:
+    return f"{PIPELINE_VERSION}:{parser}"
+
+def cached_record(cache, doc_name: str, doc_tokens: int, content_hash: str, levels: list, parser: str):
+    """The output record of a document if every level is in the cache."""
+    if cache is None or content_hash is None:
+        return None
+    tokenizer = get_encoding().name
+    truncations = {}
+    for level in levels:
+        html = cache.get_truncation(content_hash, tokenizer, doc_tokens * level, _pipeline_key(parser))
+        if html is None:
+            return None
+        truncations[str(level)] = html
+    return {"doc_name": doc_name, "doc_tokens": doc_tokens, "truncations": truncations}
+
+def run_truncation_pipeline(documents, out_path: str, levels: list, parser: str = "html.parser",
+                            workers: int = None, max_in_flight: int = None, cache=None) -> int:
+    """
+    Truncates ``documents`` (iterable of (doc_name, path, doc_tokens,
+    content_hash)) in a process pool and appends one JSON line per document
+    to ``out_path`` as results complete. Documents already in the output are
+    skipped, so an interrupted run resumes where it stopped; those logged
+    without one of ``levels`` (an earlier run with other levels) are
+    truncated again and logged anew. With a
+    PreprocessingCache as ``cache``, documents whose truncations are cached
+    are not truncated again and new truncations are added to it.
+
+    At most ``max_in_flight`` documents are submitted at a time, which bounds
+    memory, and lines are written in input order, so the output file does not
+    depend on the number of workers. Returns the number of documents written.
+    """
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 4 * workers
+    done = completed_documents(out_path, levels)
+    written = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(out_path, "a", encoding="utf-8") as out:
+        in_flight = deque()
+
+        def write_oldest():
+            content_hash, pending = in_flight.popleft()
+            if isinstance(pending, dict):
+                record = pending
+            else:
+                record = pending.result()
+                if cache is not None and content_hash is not None:
+                    tokenizer = get_encoding().name
+                    for level in levels:
+                        cache.put_truncation(content_hash, tokenizer, record["doc_tokens"] * level,
+                                             _pipeline_key(parser), record["truncations"][str(level)])
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+        for doc_name, path, doc_tokens, content_hash in documents:
+            if doc_name in done:
+                continue
+            record = cached_record(cache, doc_name, doc_tokens, content_hash, levels, parser)
+            if record is None:
+                record = executor.submit(truncate_document, (doc_name, path, doc_tokens, levels, parser))
+            in_flight.append((content_hash, record))
+            if len(in_flight) >= max_in_flight:
+                write_oldest()
+                written += 1
+        while in_flight:
+            write_oldest()
+            written += 1
+
+    return written
@@ -15,34 +15,40 @@ sys.path.append(ROOT)
 
 
 from local_llm_inference_github_version import *
+from inference_scheduler_github_version import *
+from model_lifecycle_github_version import *
 from prompt_template_github_version import *
 from extract_json_github_version import *
+from dataset_manifest_github_version import *
+from result_log_github_version import *
+from preprocessing_cache_github_version import *
+from truncate_html_functions_github_version import *
+from budget_planner_github_version import *
+from cascade_github_version import *
+from endpoint_pool_github_version import *
+from metrics_github_version import *
 
 
 
 # ---- Read Data ----
 
 data_path = "/workspace/dataset/temp"
-files = os.listdir(data_path)
-#print(files)
 
-d = {}
-
-# Load all JSON files into dictionary d
-for i in files:
-    if i.endswith("json"):
-        with open(os.path.join(data_path, i), 'r') as file:
-            d[i] = json.load(file)
+# Index the datasets instead of loading them; pages are read one at a time
+# while the loop below runs
+cache = PreprocessingCache("/workspace/cache/preprocessing.sqlite")
+benign_5 = build_record_manifest(os.path.join(data_path, "benign_5_url.json"), cache=cache)
+phish_5 = build_record_manifest(os.path.join(data_path, "phish_5_url.json"), cache=cache)
 
 # Extract phishing keys
-phish = list(d["phish_5_url.json"].keys())
+phish = {entry["doc_name"] for entry in phish_5}
 
 # Merge benign and phishing datasets into d5
-d5 = d["benign_5_url.json"]
-d5.update(d["phish_5_url.json"])
+d5 = merge_manifests(benign_5, phish_5)
 
-#d50 = d["benign_50.json"]
-#d50.update(d["phish_50.json"])
+#benign_50 = build_record_manifest(os.path.join(data_path, "benign_50.json"), cache=cache)
+#phish_50 = build_record_manifest(os.path.join(data_path, "phish_50.json"), cache=cache)
+#d50 = merge_manifests(benign_50, phish_50)
 
 
 d_all = {"d5":d5}#,"d50": d50}
@@ -54,65 +60,251 @@ model_list = [i["model"] for i in ollama.list()["models"]]
 #or manually
 #model_list = ["dolphin3:8b", "phi3:medium", "mistral-nemo:latest", "qwen3:4b", "gemma3:4b", "gemma3:12b", "deepseek-r1:1.5b", "llama3.2:1b", "llama3.1:8b"]
 
+# Run the models smallest first to keep load/unload swaps cheap
+order_by_size = True
+if order_by_size:
+    model_list = order_models_by_size(model_list)
+
 
 # ---- Create CSV Loop ----
 page_runs = 2
 
-t5=time.time()
-for m in model_list:
-    result_collection = {} # stores results per model
-    
-    if not m in result_collection.keys():
-        result_collection[m] = {}
-       
+# Prompt template (see PROMPT_TEMPLATES): "v4" as used for the published
+# results, "v5" puts the static instructions first so the server can reuse
+# their KV cache across pages
+prompt_version = "v4"
+
+# Requests in flight per model; keep at or below the server's OLLAMA_NUM_PARALLEL
+concurrency = 4
+
+# Per-model overrides of concurrency, e.g. fewer slots for the largest model
+# whose KV cache would not fit OLLAMA_NUM_PARALLEL copies: {"gemma3:12b": 2}
+model_concurrency = {}
+
+# Every finished run is appended to this log right away; with resume = True a
+# restarted sweep only schedules the runs that are not in the log yet
+log_path = "/workspace/results/temp/results_log.jsonl"
+resume = True
+
+# None runs every request to num_predict; "early_stop" stops generation once the
+# verdict JSON is complete, "structured" also constrains the output to the
+# verdict schema. Both record early_stop and tokens_saved in the timings
+json_mode = None
+
+# Tokens generated per request
+num_predict = 750
+
+# Fit every prompt into the model's context window: pages over the model's
+# page budget are truncated further, and each model block runs with the
+# smallest num_ctx its prompts need, at most max_num_ctx (bounds the KV cache).
+# Off by default: it changes prompts and num_ctx compared to the published runs
+plan_budgets = False
+max_num_ctx = 32768
+
+# "sweep" sends every page to every model page_runs times; "cascade" sends
+# each page once to the smallest model and moves it up to the next larger
+# model only while its phishing_score is in uncertain_band (inclusive) or its
+# output has no parseable verdict. cascade_github_version.py replays the
+# cascade on a sweep log to tune the band
+mode = "sweep"
+uncertain_band = UNCERTAIN_BAND
+
+# Several Ollama hosts for one sweep: with endpoints set, the sweep shards all
+# (model, page, run) units over them with work stealing and records the host
+# of every result. "models" defaults to every model of the host, "slots"
+# should match the host's OLLAMA_NUM_PARALLEL
+endpoints = None
+#endpoints = [{"host": "http://gpu-1:11434", "slots": 4},
+#             {"host": "http://gpu-2:11434", "models": ["gemma3:4b", "qwen3:4b"], "slots": 2}]
+
+# Columnar copy of all logged runs (fixed schema, verdicts parsed) and the
+# metrics per model and truncation level, written at the end of the sweep.
+# Parquet lets later analysis read single columns; without pyarrow the store
+# is written as .pkl next to this path instead
+results_store = "/workspace/results/temp/results.parquet"
+metrics_path = "/workspace/results/temp/metrics.csv"
+
+if not resume and os.path.exists(log_path):
+    os.remove(log_path)
+result_log = ResultLog(log_path)
+completed = result_log.completed()
+
+def page_prompt(entry, ws, plan):
+    # Prompt for one page and its GPT-4 token count as sent
+    original_len = len(ws)
+    page_tokens = entry["token_count"]
+    if plan and page_tokens > plan["page_budget"]:
+        # Would not fit the model's window: truncate here instead of
+        # letting the server silently cut the prompt
+        ws = truncate_html_to_tokens_merged(ws, max_tokens=plan["page_budget"])
+        page_tokens = len(get_encoding("gpt-4").encode(ws))
+    # Build prompt from HTML and metadata
+    return build_prompt(ws, original_len, version=prompt_version), page_tokens
+
+def work_units(m, dname, ds, plan, pages=None, runs=None):
+    # One unit per (page, run) still missing from the log; pages are read and
+    # prompts built only when the scheduler is ready to send them. ``pages``
+    # limits the units to those pageIDs, ``runs`` to those runs
+    for pageID, (entry, (ws_name, ws)) in enumerate(zip(ds, iter_pages(ds))):
+        if pages is not None and pageID not in pages:
+            continue
+        runs_todo = [i for i in (runs or range(page_runs)) if (m, dname, pageID, i) not in completed]
+        if not runs_todo:
+            continue
+        html_prompt, page_tokens = page_prompt(entry, ws, plan)
+        for i in runs_todo:
+            yield {"pageID": pageID, "run": i, "ws_name": ws_name, "prompt": html_prompt, "page_tokens": page_tokens}
+
+# Model load and warm-up costs, kept apart from the per-page timings
+load_reports = {}
+
+def model_plan(m, host=None):
+    # Budget plan and num_ctx of model m; one num_ctx for all its requests,
+    # since a change reloads the model
+    if not plan_budgets:
+        return None, None
+    plan = plan_budget(m, num_predict=num_predict, prompt_version=prompt_version, max_num_ctx=max_num_ctx,
+                       host=host)
+    num_ctx = max(request_num_ctx(plan, entry["token_count"]) for ds in d_all.values() for entry in ds)
+    print(plan, num_ctx)
+    return plan, num_ctx
+
+def make_run_result(unit, analysis_result, runtime, timings, num_ctx):
+    # Store results; runtime excludes time spent waiting for a slot
+    run_result = {}
+    run_result["ws_name"] = unit["ws_name"]
+    run_result["True_Phish_Label"] = unit["ws_name"] in phish
+    run_result["runtime"] = runtime
+    run_result["prompt_len"] = unit["prompt_len"]
+    run_result["page_tokens"] = unit["page_tokens"]
+    run_result["num_ctx"] = num_ctx
+    run_result["analysis_result"] = analysis_result
+    # Server-side breakdown: load, prompt eval, generation, tokens/sec, time to first token
+    run_result["timings"] = timings
+    return run_result
+
+def run_model(m, pages=None, runs=None):
+    # Runs model m over every dataset (or the pageIDs in pages[dname]) and
+    # saves its results, consolidated from the log
     print(m)
     print(time.time())
     
-    for dname, ds in d_all.items():
-        if not dname in result_collection[m].keys():
-            result_collection[m][dname] = {}
-            
-        pageID = 0
+    plan, num_ctx = model_plan(m)
     
-        # Iterate over dataset entries (websites)
-        for ws_name, ws in list(ds.items()):
+    # Preload, warm up and pin the model for its block; unloaded afterwards
+    with ModelSession(m, num_ctx=num_ctx) as session:
+        for dname, ds in d_all.items():
+            # Called as soon as each result arrives
+            def store_result(unit, analysis_result, runtime, timings):
+                unit["prompt_len"] = len(unit["prompt"])
+                run_result = make_run_result(unit, analysis_result, runtime, timings, num_ctx)
+                result_log.append(m, dname, unit["pageID"], unit["run"], run_result)
             
-            if not pageID in result_collection[m][dname].keys():
-                result_collection[m][dname][pageID] = {}
-                
-            true_label = ws_name in phish
+            # Run model inference concurrently, up to the model's concurrency at a time
+            units = work_units(m, dname, ds, plan, pages=None if pages is None else pages[dname], runs=runs)
+            run_scheduled_inference(units, m, store_result, concurrency=concurrency,
+                                    max_tokens=num_predict, ordered=False, keep_alive=session.keep_alive,
+                                    json_mode=json_mode, num_ctx=num_ctx, model_concurrency=model_concurrency)
+    load_reports[m] = session.load_report
             
-            for i in range(page_runs):
-                run_result = {}
-                
-                # Build prompt from HTML and metadata
-                html_prompt = build_html_prompt_v4(ws, len(ws))
-                
-                # Run model inference and time it
-                t1 = time.time()
-                analysis_result = local_llm_infer_v2(html_prompt, max_tokens = 750, model = m)
-                t2 = time.time()
-                
-                # Store results
-                run_result["ws_name"] = ws_name
-                run_result["True_Phish_Label"] = true_label
-                run_result["runtime"] = t2 - t1
-                run_result["prompt_len"] = len(html_prompt)
-                run_result["analysis_result"] = analysis_result
-                
-                result_collection[m][dname][pageID][i] = run_result 
-                
-            # Save intermediate results periodically
-            if pageID in [200,400,600,800]:
-                save_loc1 = f"/workspace/results/temp/res_{m}_all_{pageID}.json"
-                with open(save_loc1, 'w') as fp:
-                    json.dump(result_collection, fp)
-                    
-            pageID += 1
-            
-    # Save results for this model        
+    save_model_results(m)
+
+    # Save the load/warm-up costs of every model run so far
+    with open("/workspace/results/temp/model_loads.json", 'w') as fp:
+        json.dump(load_reports, fp)
+
+def save_model_results(m):
+    # Save results for this model, consolidated from the log
     save_loc = f"/workspace/results/temp/res_{m}_all.json"
     with open(save_loc, 'w') as fp:
-        json.dump(result_collection, fp) 
+        json.dump(result_log.consolidate(m), fp) 
+
+def run_pooled_sweep():
+    # Every (model, page, run) unit missing from the log, sharded over the
+    # endpoints; prompts are built when a unit is sent. The pool preloads and
+    # warms up each model on each host before its first timed request and
+    # unloads it afterwards, as ModelSession does in run_model
+    pool = [e if isinstance(e, Endpoint) else Endpoint(**e) for e in endpoints]
+    plans, num_ctxs, units = {}, {}, []
+    for m in model_list:
+        host = next((e.host for e in pool if e.models is None or m in e.models), None)
+        plans[m], num_ctxs[m] = model_plan(m, host=host)
+        for dname, ds in d_all.items():
+            for pageID, entry in enumerate(ds):
+                for i in range(page_runs):
+                    if (m, dname, pageID, i) not in completed:
+                        units.append({"model": m, "dname": dname, "pageID": pageID, "run": i, "entry": entry})
+
+    # Each page is read and its prompt built once per model, and reused by
+    # its other runs until the last one has been sent
+    def prompt_key(unit):
+        return unit["model"], unit["dname"], unit["pageID"]
+
+    prompts, prompt_uses = {}, {}
+    for unit in units:
+        prompt_uses[prompt_key(unit)] = prompt_uses.get(prompt_key(unit), 0) + 1
+
+    def prompt_of(unit):
+        entry, key = unit["entry"], prompt_key(unit)
+        if key not in prompts:
+            prompts[key] = page_prompt(entry, read_page(entry), plans[unit["model"]])
+        html_prompt, unit["page_tokens"] = prompts[key]
+        # A retried unit asks again after its count ran out and rebuilds it
+        prompt_uses[key] -= 1
+        if prompt_uses[key] <= 0:
+            del prompts[key]
+        unit["ws_name"], unit["prompt_len"] = entry["doc_name"], len(html_prompt)
+        return html_prompt
+
+    def store_result(unit, analysis_result, runtime, timings, endpoint):
+        run_result = make_run_result(unit, analysis_result, runtime, timings, num_ctxs[unit["model"]])
+        # Host that served this run
+        run_result["endpoint"] = endpoint
+        result_log.append(unit["model"], unit["dname"], unit["pageID"], unit["run"], run_result)
+
+    report = run_pooled_inference(units, pool, store_result, prompt_of=prompt_of, max_tokens=num_predict,
+                                  keep_alive=-1, json_mode=json_mode, num_ctx=num_ctxs)
+    print(report["served"])
+    for host, error in report["unreachable"]:
+        print("unreachable:", host, error)
+    for unit, error in report["failed"]:
+        print("failed:", unit["model"], unit["dname"], unit["pageID"], unit["run"], error)
+    for m in model_list:
+        save_model_results(m)
+
+    # Load/warm-up costs per host and model, kept apart from the per-page timings
+    with open("/workspace/results/temp/model_loads.json", 'w') as fp:
+        json.dump(report["loads"], fp)
+
+t5=time.time()
+if mode == "sweep" and endpoints:
+    run_pooled_sweep()
+elif mode == "sweep":
+    for m in model_list:
+        run_model(m)
+elif mode == "cascade":
+    # Cascade: run 0 of every page through model_list (smallest first, see
+    # order_by_size); a page moves on only while its answer needs escalation
+    pages = {dname: set(range(len(ds))) for dname, ds in d_all.items()}
+    for m in model_list:
+        if not any(pages.values()):
+            break
+        run_model(m, pages=pages, runs=[0])
+        logged = {(r["dataset"], r["pageID"]): r for r in result_log.records if r["model"] == m and r["run"] == 0}
+        pages = {dname: {p for p in ids if needs_escalation(logged[(dname, p)]["analysis_result"], uncertain_band)}
+                 for dname, ids in pages.items()}
+    
+    # Escalation rates per stage and compute saved against the full sweep
+    cascade = replay_cascade(result_log.records, model_list, band=uncertain_band, page_runs=page_runs)
+    print(cascade)
+    with open("/workspace/results/temp/cascade_report.json", 'w') as fp:
+        json.dump(cascade, fp)
+else:
+    raise ValueError(f"Unknown mode {mode!r}, expected 'sweep' or 'cascade'")
+
+results = records_to_frame(result_log.records)
+print("results store:", save_results(results, results_store))
+metrics_report(results).to_csv(metrics_path)
 
+result_log.close()
 t6=time.time()